@@ -0,0 +1,334 @@
+"""Benchmarks for the form library.
+
+Run from the source tree::
+
+  $ python benchmarks/bench.py
+
+Each benchmark reports the time per operation and the number of
+objects allocated per operation (objects that are tracked by the
+garbage collector and reachable from the result). To record a
+baseline and compare against it later::
+
+  $ python benchmarks/bench.py --save baseline.json
+  $ python benchmarks/bench.py --compare baseline.json
+
+With ``--compare``, the exit status is non-zero if a benchmark is
+slower than the baseline by more than the ``--threshold`` factor.
+"""
+
+import gc
+import os
+import sys
+import timeit
+import optparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), os.pardir, 'src'))
+
+from repoze.formapi import Form
+from repoze.formapi import Proxy
+from repoze.formapi import parse
+from repoze.formapi import action
+from repoze.formapi import validator
+from repoze.formapi import required
+from repoze.formapi.py24 import json
+
+benchmarks = []
+
+
+def benchmark(name):
+    def decorator(func):
+        benchmarks.append((name, func))
+        return func
+    return decorator
+
+
+def make_fields(width, depth, leaf=int):
+    """Return fields definition ``depth`` levels deep with ``width``
+    entries on each level."""
+
+    if depth == 0:
+        return leaf
+    fields = {}
+    for i in range(width):
+        fields['f%d' % i] = make_fields(width, depth - 1, leaf)
+    return fields
+
+
+def make_params(fields, prefix='', value='42'):
+    """Return a parameter for each end-point of ``fields``."""
+
+    params = []
+    for key, field in sorted(fields.items()):
+        name = prefix + key
+        if isinstance(field, dict):
+            params.extend(make_params(field, name + '.', value))
+        else:
+            params.append((name, value))
+    return params
+
+
+def make_form(fields, actions=0, validators=0):
+    namespace = {'fields': fields}
+
+    for i in range(actions):
+        def handler(form, data):
+            return True
+        namespace['action_%d' % i] = action('a%d' % i)(handler)
+
+    for i in range(validators):
+        def check(form):
+            if form.data['f0'] is None:
+                yield 'Required'
+        namespace['validator_%d' % i] = validator('f0')(check)
+
+    return type('BenchmarkForm', (Form,), namespace)
+
+
+# parse
+
+def parse_benchmark(fields, params):
+    def run():
+        return parse(params, fields)
+    return run
+
+
+fields = make_fields(50, 1)
+benchmark('parse-wide-50')(parse_benchmark(fields, make_params(fields)))
+
+fields = make_fields(3, 5)
+benchmark('parse-deep-3x5')(parse_benchmark(fields, make_params(fields)))
+
+fields = {'users': {str: make_fields(5, 1, unicode)}}
+benchmark('parse-dynamic-100')(parse_benchmark(fields, [
+    ('users.u%d.f%d' % (i, j), 'value')
+    for i in range(100) for j in range(5)]))
+
+benchmark('parse-list-1000')(parse_benchmark(
+    {'ids': [int]}, [('ids', str(i)) for i in range(1000)]))
+
+benchmark('parse-tuple-1000')(parse_benchmark(
+    {'ids': (int,)}, [('ids', str(i)) for i in range(1000)]))
+
+# the same input as dotted parameters and as a nested mapping (e.g. a
+# decoded JSON body); nested input is parsed level by level, with the
+# field of each value resolved by the compiled schema, which makes it
+# the faster of the two
+fields = make_fields(20, 2)
+benchmark('parse-nested-20x2')(parse_benchmark(
+    fields, make_params(fields)))
+
+benchmark('parse-nested-json-20x2')(parse_benchmark(
+    fields, json.loads(json.dumps(dict([
+        (key, dict([('f%d' % j, '42') for j in range(20)]))
+        for key in fields])))))
+
+
+# generated parsers
+
+from repoze.formapi.codegen import get_parser
+
+
+def generated_benchmark(fields, params):
+    parse = get_parser(fields)
+
+    def run():
+        return parse(params, fields)
+    return run
+
+
+fields = make_fields(50, 1)
+benchmark('codegen-wide-50')(generated_benchmark(
+    fields, make_params(fields)))
+
+fields = make_fields(3, 5)
+benchmark('codegen-deep-3x5')(generated_benchmark(
+    fields, make_params(fields)))
+
+benchmark('codegen-list-1000')(generated_benchmark(
+    {'ids': [int]}, [('ids', str(i)) for i in range(1000)]))
+
+
+# schema compilation
+
+from repoze.formapi.schema import Schema
+from repoze.formapi.cache import get_schema
+
+schema_fields = make_fields(20, 2)
+
+
+@benchmark('schema-compile-20x2')
+def run():
+    return Schema(schema_fields)
+
+
+@benchmark('schema-cached-20x2')
+def run():
+    return get_schema(schema_fields)
+
+
+# form construction
+
+fields = make_fields(20, 1)
+params = make_params(fields)
+plain_form = make_form(fields)
+action_form = make_form(fields, actions=5)
+
+
+@benchmark('form-init-empty')
+def run():
+    return plain_form()
+
+
+@benchmark('form-init-20')
+def run():
+    return plain_form(params=params)
+
+
+@benchmark('form-init-prefix-actions-20')
+def run():
+    return action_form(params=params + [('form.a3', '')], prefix='form')
+
+
+@benchmark('form-init-prefix-not-submitted-20')
+def run():
+    return action_form(params=params, prefix='form')
+
+
+# validation
+
+validated_form = make_form(
+    dict(fields, f0=required(int)), validators=20)
+
+
+@benchmark('form-validate-20-validators')
+def run():
+    form = validated_form(params=params)
+    form.validate()
+    return form
+
+
+# error rendering
+
+error_fields = make_fields(10, 2)
+invalid = make_form(error_fields)(
+    params=make_params(error_fields, value='invalid'))
+
+
+@benchmark('errors-render-100')
+def run():
+    errors = invalid.errors
+    return [unicode(errors[a][b])
+            for a in error_fields for b in error_fields[a]]
+
+
+# proxy-backed save
+
+class Content(object):
+    pass
+
+fields = make_fields(20, 1)
+params = make_params(fields)
+proxy_form = make_form(fields)
+
+
+@benchmark('data-save-proxy-20')
+def run():
+    content = Content()
+    form = proxy_form(Proxy(content), params=params)
+    form.data.save()
+    return content
+
+
+def measure(func, number, repeat):
+    """Return ``(seconds, objects)`` per operation."""
+
+    timer = timeit.Timer(func)
+    seconds = min(timer.repeat(repeat, number)) / number
+
+    enabled = gc.isenabled()
+    gc.collect()
+    gc.disable()
+    try:
+        results = []
+        before = len(gc.get_objects())
+        for i in xrange(number):
+            results.append(func())
+        objects = (len(gc.get_objects()) - before - 1) / float(number)
+    finally:
+        if enabled:
+            gc.enable()
+
+    return seconds, objects
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage="%prog [options] [pattern]")
+    parser.add_option(
+        "-n", "--number", type="int", default=200,
+        help="Number of operations per timing run.")
+    parser.add_option(
+        "-r", "--repeat", type="int", default=5,
+        help="Number of timing runs (the best run is reported).")
+    parser.add_option(
+        "--save", metavar="FILE",
+        help="Save results as baseline.")
+    parser.add_option(
+        "--compare", metavar="FILE",
+        help="Compare results against baseline.")
+    parser.add_option(
+        "--threshold", type="float", default=1.25,
+        help="Slowdown factor that fails the comparison.")
+
+    options, args = parser.parse_args(argv)
+
+    baseline = {}
+    if options.compare:
+        f = open(options.compare)
+        try:
+            baseline = json.load(f)
+        finally:
+            f.close()
+
+    results = {}
+    failed = []
+
+    print "%-36s %12s %10s %10s" % (
+        "benchmark", "usec/op", "objs/op", "baseline")
+
+    for name, func in benchmarks:
+        if args and not [arg for arg in args if arg in name]:
+            continue
+
+        seconds, objects = measure(func, options.number, options.repeat)
+        results[name] = {'seconds': seconds, 'objects': objects}
+
+        comparison = ''
+        previous = baseline.get(name)
+        if previous is not None:
+            ratio = seconds / previous['seconds']
+            comparison = "%.2fx" % ratio
+            if ratio > options.threshold:
+                comparison += " !"
+                failed.append(name)
+
+        print "%-36s %12.1f %10.1f %10s" % (
+            name, seconds * 1e6, objects, comparison)
+
+    if options.save:
+        f = open(options.save, 'w')
+        try:
+            json.dump(results, f, indent=2, sort_keys=True)
+        finally:
+            f.close()
+
+    if failed:
+        print
+        print "Slower than baseline: %s" % ", ".join(failed)
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
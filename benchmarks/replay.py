@@ -0,0 +1,64 @@
+"""Replay of captured form input.
+
+Input is captured in production by installing a ``Capture`` observer
+(see ``repoze.formapi.capture``)::
+
+  from repoze.formapi import instrument
+  from repoze.formapi.capture import Capture
+  instrument.install(Capture('/var/tmp/forms.capture', rate=0.01,
+                             redact=('password', 'email')))
+
+The captured input is then replayed offline through the same form
+classes, which must be importable (e.g. set ``PYTHONPATH``)::
+
+  $ python benchmarks/replay.py /var/tmp/forms.capture --repeat 10
+
+For each form class, the throughput, latency percentiles and the
+number of objects allocated per form are reported. Submitted actions
+are not called unless ``--call`` is given.
+"""
+
+import os
+import sys
+import optparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), os.pardir, 'src'))
+
+from repoze.formapi.capture import load
+from repoze.formapi.capture import replay
+from repoze.formapi.capture import report
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage="%prog [options] FILE...")
+    parser.add_option(
+        "-r", "--repeat", type="int", default=1,
+        help="Number of times the input is replayed.")
+    parser.add_option(
+        "-f", "--form", action="append", default=[],
+        help="Replay input of form classes matching this name only.")
+    parser.add_option(
+        "--call", action="store_true", default=False,
+        help="Call submitted actions (which may have side effects).")
+
+    options, args = parser.parse_args(argv)
+    if not args:
+        parser.error("No capture file given.")
+
+    records = []
+    for path in args:
+        records.extend(load(path))
+
+    if options.form:
+        records = [
+            record for record in records
+            if [name for name in options.form if name in record[0]]]
+
+    statistics = replay(records, repeat=options.repeat, call=options.call)
+    print report(statistics)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,105 @@
+"""Concurrency stress test.
+
+Drives many threads through shared form classes and verifies that
+each thread sees the same outcome as a single-threaded run::
+
+  $ python benchmarks/stress.py --threads 32 --iterations 50
+
+The exit status is non-zero if any outcome differs.
+"""
+
+import os
+import sys
+import optparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), os.pardir, 'src'))
+
+from repoze.formapi import Form
+from repoze.formapi import action
+from repoze.formapi import validator
+from repoze.formapi import required
+from repoze.formapi.stress import stress
+
+
+class TapeForm(Form):
+    fields = {
+        'artist': required(unicode),
+        'title': unicode,
+        'year': int,
+        'playtime': float,
+        'tags': [str],
+        'tracks': {str: {'title': unicode, 'length': int}},
+        }
+
+    @validator('year')
+    def check_year(self):
+        year = self.data['year']
+        if year is not None and year < 1900:
+            yield "Too early"
+
+    @validator
+    def check_tracks(self):
+        if len(self.data['tracks'].keys()) > 10:
+            yield "Too many tracks"
+
+    @action("save")
+    def save(self, data):
+        return data['artist'], data['year']
+
+    @action("delete")
+    def delete(self, data):
+        return 'deleted'
+
+
+def make_inputs(count):
+    inputs = []
+    for i in range(count):
+        params = [
+            ('artist', i % 7 and u'Artist %d' % i or u''),
+            ('title', u'Title %d' % i),
+            ('year', str(1850 + i * 7 % 200)),
+            ('playtime', i % 5 and '%d.5' % i or 'long'),
+            ]
+        params.extend([('tags', 'tag%d' % j) for j in range(i % 4)])
+        for j in range(i % 13):
+            params.append(('tracks.t%d.title' % j, u'Track %d' % j))
+            params.append(('tracks.t%d.length' % j, str(j * 30)))
+        params.append(('tape.%s' % ('save', 'delete')[i % 2], ''))
+        inputs.append(dict(params=params, prefix='tape'))
+    return inputs
+
+
+def main(argv=None):
+    parser = optparse.OptionParser()
+    parser.add_option(
+        "-t", "--threads", type="int", default=16,
+        help="Number of threads.")
+    parser.add_option(
+        "-i", "--iterations", type="int", default=20,
+        help="Number of times each thread processes all inputs.")
+    parser.add_option(
+        "-n", "--inputs", type="int", default=50,
+        help="Number of distinct inputs.")
+
+    options, args = parser.parse_args(argv)
+
+    inputs = make_inputs(options.inputs)
+    mismatches = stress(
+        TapeForm, inputs, options.threads, options.iterations)
+
+    total = options.threads * options.iterations * len(inputs)
+    print "%d forms processed in %d threads, %d mismatches." % (
+        total, options.threads, len(mismatches))
+
+    for kwargs, expected, actual in mismatches[:10]:
+        print
+        print "input:   ", kwargs
+        print "expected:", expected
+        print "actual:  ", actual
+
+    return bool(mismatches)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,3 +2,5 @@ from form import Form, Proxy
 from form import validator, action
 from parser import required
 from parser import parse
+from multipart import upload
+from encoder import encode
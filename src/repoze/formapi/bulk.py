@@ -0,0 +1,275 @@
+from itertools import islice
+
+from repoze.formapi.encoder import get
+from repoze.formapi.encoder import keys
+from repoze.formapi.parser import missing
+from repoze.formapi.schema import Node
+from repoze.formapi.instrument import field_name
+from repoze.formapi.py24 import deque
+
+
+class Outcome(object):
+    """Result of processing a single record.
+
+    The ``data`` attribute is a plain (nested) dictionary of the form
+    data, ``errors`` is a list of ``(path, message)`` tuples, ``action``
+    is the name of the submitted action (or ``None``) and ``status`` is
+    the value returned by the action. Outcomes can be pickled, provided
+    that the data values and status can."""
+
+    def __init__(self, index, data, errors, action=None, status=None):
+        self.index = index
+        self.data = data
+        self.errors = errors
+        self.action = action
+        self.status = status
+
+    def __nonzero__(self):
+        return not self.errors
+
+    def __repr__(self):
+        return '<%s index=%d errors=%d>' % (
+            type(self).__name__, self.index, len(self.errors))
+
+
+class Summary(object):
+    """Aggregate error summary; errors are counted per field (with
+    dynamic keys collapsed) and message."""
+
+    def __init__(self, form_class):
+        self.form_class = form_class
+        self.total = 0
+        self.invalid = 0
+        self.errors = {}
+
+    def add(self, outcome):
+        self.total += 1
+        if outcome.errors:
+            self.invalid += 1
+        for path, message in outcome.errors:
+            key = field_name(self.form_class, path), message
+            self.errors[key] = self.errors.get(key, 0) + 1
+
+    def items(self):
+        """Return list of ``(count, field, message)`` tuples, most
+        frequent first."""
+
+        items = [(count, name, message) for ((name, message), count)
+                 in self.errors.items()]
+        items.sort(key=lambda item: (-item[0], item[1], item[2]))
+        return items
+
+    def dump(self):
+        """Return summary as text."""
+
+        lines = ["%d records, %d invalid" % (self.total, self.invalid)]
+        for count, name, message in self.items():
+            lines.append("%7d  %s: %s" % (count, name or '(form)', message))
+        return "\n".join(lines)
+
+
+def bulk(form_class, records, prefix=None, chunksize=100, pool=None,
+         window=None, summary=None, call=True):
+    """Process ``records`` with ``form_class``; yields an ``Outcome``
+    for each record, in input order.
+
+    Each record is passed as ``params`` to the form constructor; the
+    form is validated and the submitted action (if any) is called.
+    Records are consumed lazily, one chunk of ``chunksize`` records at
+    a time.
+
+        >>> from repoze.formapi.bulk import bulk, Summary
+
+        >>> class TapeForm(Form):
+        ...     fields = {
+        ...         'title': required(unicode),
+        ...         'year': int,
+        ...         'tracks': {str: {'length': int}}}
+        ...
+        ...     @validator('year')
+        ...     def check_year(self):
+        ...         year = self.data['year']
+        ...         if year is not None and year < 1900:
+        ...             yield "Too early"
+        ...
+        ...     @action("import")
+        ...     def save(self, data):
+        ...         return data['title'].upper()
+
+        >>> records = [
+        ...     (('title', u'Moonmadness'), ('year', '1976'),
+        ...      ('tracks.a1.length', '138'), ('tape.import', '')),
+        ...     (('title', u''), ('year', '1876'), ('tape.import', '')),
+        ...     (('title', u'Rain Dances'), ('year', 'late'),
+        ...      ('tracks.a1.length', 'long'), ('tape.import', '')),
+        ...     ]
+
+        >>> summary = Summary(TapeForm)
+        >>> outcomes = bulk(
+        ...     TapeForm, iter(records), prefix='tape', chunksize=2,
+        ...     summary=summary)
+
+        >>> for outcome in outcomes:
+        ...     print outcome.index, outcome.action, outcome.status
+        ...     print sorted(outcome.data.items())
+        ...     print outcome.errors
+        0 import MOONMADNESS
+        [('title', u'Moonmadness'), ('tracks', {'a1': {'length': 138}}),
+         ('year', 1976)]
+        []
+        1 import None
+        [('title', None), ('tracks', {}), ('year', 1876)]
+        [(('title',), u'Required field'), (('year',), u'Too early')]
+        2 import None
+        [('title', u'Rain Dances'), ('tracks', {'a1': {'length': 'long'}}),
+         ('year', 'late')]
+        [(('tracks', 'a1', 'length'), u"invalid literal for int()..."),
+         (('year',), u"invalid literal for int()...")]
+
+    The form is not submitted for records that do not validate; values
+    that fail conversion are passed through as-is. The summary
+    aggregates the errors of all records; dynamic keys are collapsed.
+
+        >>> print summary.dump()
+        3 records, 2 invalid
+              1  title: Required field
+              1  tracks.*.length: invalid literal for int()...
+              1  year: Too early
+              1  year: invalid literal for int()...
+
+    To fan chunks out to workers, pass a pool with an ``apply_async``
+    method, e.g. ``multiprocessing.Pool``. At most ``window`` chunks
+    are in flight at a time (by default, two per CPU; pass twice the
+    number of workers of a pool of another size); outcomes are still
+    yielded in input order.
+
+        >>> from multiprocessing.dummy import Pool
+        >>> pool = Pool(2)
+        >>> outcomes = bulk(
+        ...     TapeForm, iter(records * 100), prefix='tape',
+        ...     chunksize=7, pool=pool)
+        >>> [outcome.index for outcome in outcomes] == range(300)
+        True
+        >>> pool.close()
+
+    With a process pool, the form class must be importable by the
+    workers (i.e. defined at module level) and the records, data and
+    status must be picklable.
+
+    To validate records only, pass a false ``call`` argument; actions
+    are then not called.
+
+        >>> [outcome.status for outcome in bulk(
+        ...     TapeForm, records, prefix='tape', call=False)]
+        [None, None, None]
+
+    """
+
+    if chunksize < 1:
+        raise ValueError("Chunk size must be positive.")
+
+    records = iter(records)
+
+    if pool is None:
+        outcomes = iter_chunks(
+            form_class, records, prefix, chunksize, call)
+    else:
+        if window is None:
+            window = 2 * cpu_count()
+        outcomes = iter_pool(
+            form_class, records, prefix, chunksize, pool, window, call)
+
+    for chunk in outcomes:
+        for outcome in chunk:
+            if summary is not None:
+                summary.add(outcome)
+            yield outcome
+
+
+def cpu_count():
+    try:
+        from multiprocessing import cpu_count
+        return cpu_count()
+    except (ImportError, NotImplementedError):
+        return 1
+
+
+def iter_chunks(form_class, records, prefix, chunksize, call=True):
+    index = 0
+    while True:
+        chunk = list(islice(records, chunksize))
+        if not chunk:
+            break
+        yield process_chunk(form_class, chunk, prefix, index, call)
+        index += len(chunk)
+
+
+def iter_pool(form_class, records, prefix, chunksize, pool, window,
+              call=True):
+    pending = deque()
+    index = 0
+    exhausted = False
+
+    while True:
+        # keep the window filled
+        while not exhausted and len(pending) < window:
+            chunk = list(islice(records, chunksize))
+            if not chunk:
+                exhausted = True
+                break
+            pending.append(pool.apply_async(
+                process_chunk, (form_class, chunk, prefix, index, call)))
+            index += len(chunk)
+
+        if not pending:
+            break
+
+        yield pending.popleft().get()
+
+
+def process_chunk(form_class, chunk, prefix, start, call=True):
+    """Process a chunk of records; returns a list of outcomes."""
+
+    schema = form_class.schema
+    outcomes = []
+    for index, params in enumerate(chunk):
+        form = form_class(params=params, prefix=prefix)
+        if form.validate() and call:
+            form()
+
+        action = form.action
+        if action is not None:
+            action = action.name
+
+        outcomes.append(Outcome(
+            start + index,
+            plain(form.data, schema.root),
+            [(path, unicode(message))
+             for (path, message) in form.errors.flatten()],
+            action, form.status))
+
+    return outcomes
+
+
+def plain(data, node):
+    """Return ``data`` as a plain dictionary, following ``node``."""
+
+    result = {}
+    if node.dynamic is not None:
+        child = node.children[node.dynamic]
+        items = [(key, get(data, key)) for key in keys(data)]
+    else:
+        items = [(key, get(data, key)) for (key, child) in node.static]
+
+    for key, value in items:
+        if node.dynamic is None:
+            child = node.children[key]
+        if isinstance(child, Node):
+            if value is missing:
+                value = {}
+            value = plain(value, child)
+        elif value is missing:
+            value = None
+        result[key] = value
+
+    return result
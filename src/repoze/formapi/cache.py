@@ -0,0 +1,218 @@
+import threading
+
+from repoze.formapi.schema import Schema
+from repoze.formapi.multipart import FileUpload
+
+
+class LRUCache(object):
+    """Bounded cache of compiled schemas.
+
+    Schemas are keyed by the structure of the fields definition (see
+    ``structural_key``); the least recently used schema is evicted
+    when the cache is full.
+
+        >>> from repoze.formapi.cache import LRUCache
+        >>> cache = LRUCache(size=2)
+
+    Equal fields definitions share a compiled schema, even if they are
+    built from scratch.
+
+        >>> schema = cache.get({'title': unicode, 'tracks': [int]})
+        >>> cache.get({'tracks': [int], 'title': unicode}) is schema
+        True
+
+    The ``required`` wrapper creates a new class on each call; it's
+    identified by the wrapped type and the message.
+
+        >>> a = cache.get({'title': required(unicode)})
+        >>> b = cache.get({'title': required(unicode)})
+        >>> c = cache.get({'title': required(unicode, 'Missing title')})
+        >>> a is b, a is c
+        (True, False)
+
+    Hits, misses and evictions are counted.
+
+        >>> len(cache), cache.hits, cache.misses, cache.evictions
+        (2, 2, 3, 1)
+
+    The first schema was evicted (it was the least recently used).
+
+        >>> cache.get({'title': unicode, 'tracks': [int]}) is schema
+        False
+
+        >>> sorted(cache.stats().items())
+        [('evictions', 2), ('hits', 2), ('misses', 4), ('size', 2)]
+
+    """
+
+    def __init__(self, size=256):
+        if size < 1:
+            raise ValueError("Cache size must be positive.")
+
+        self.size = size
+        self.lock = threading.Lock()
+        self.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            # entries are kept in a circular, doubly linked list of
+            # ``[previous, next, key, schema]`` links, most recently
+            # used first
+            root = self.root = []
+            root[:] = [root, root, None, None]
+            self.entries = {}
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+        finally:
+            self.lock.release()
+
+    def get(self, fields):
+        """Return compiled schema for ``fields``."""
+
+        key = structural_key(fields)
+
+        self.lock.acquire()
+        try:
+            link = self.entries.get(key)
+            if link is not None:
+                self.hits += 1
+                self.unlink(link)
+                self.link(link)
+                return link[3]
+            self.misses += 1
+        finally:
+            self.lock.release()
+
+        # compile outside of the lock; if another thread compiles the
+        # same fields concurrently, the first schema added wins
+        schema = Schema(fields)
+
+        self.lock.acquire()
+        try:
+            link = self.entries.get(key)
+            if link is not None:
+                return link[3]
+
+            if len(self.entries) >= self.size:
+                last = self.root[0]
+                self.unlink(last)
+                del self.entries[last[2]]
+                self.evictions += 1
+
+            link = [None, None, key, schema]
+            self.link(link)
+            self.entries[key] = link
+        finally:
+            self.lock.release()
+
+        return schema
+
+    def stats(self):
+        """Return dictionary of cache metrics."""
+
+        return {
+            'size': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            }
+
+    def link(self, link):
+        root = self.root
+        first = root[1]
+        link[0] = root
+        link[1] = first
+        first[0] = root[1] = link
+
+    def unlink(self, link):
+        previous, next = link[0], link[1]
+        previous[1] = next
+        next[0] = previous
+
+
+def structural_key(fields):
+    """Return hashable key for a fields definition.
+
+    Unlike ``fingerprint``, field types are identified by identity; the
+    key is only valid within a process. Two keys are equal if the
+    definitions have the same structure and use the same field types.
+
+        >>> from repoze.formapi.cache import structural_key
+        >>> structural_key({'ids': [int]}) == structural_key({'ids': [int]})
+        True
+
+        >>> structural_key({'ids': [int]}) == structural_key({'ids': (int,)})
+        False
+
+        >>> structural_key({'id': int}) == structural_key({'id': long})
+        False
+
+    Form classes freeze their fields definition; forms which differ
+    only in the kind of a sequence do not share a schema.
+
+        >>> class ListForm(Form):
+        ...     fields = {'ids': [int]}
+
+        >>> class TupleForm(Form):
+        ...     fields = {'ids': (int,)}
+
+        >>> ListForm.schema is TupleForm.schema
+        False
+
+        >>> TupleForm(params={'ids': ['1', '2']}).data['ids']
+        (1, 2)
+
+    """
+
+    if isinstance(fields, dict):
+        items = []
+        for key, value in fields.iteritems():
+            if not isinstance(key, basestring):
+                key = id(key)
+            # plain types are the common case
+            if isinstance(value, type) and \
+                   'wrapped' not in value.__dict__ and \
+                   'max_size' not in value.__dict__:
+                value = id(value)
+            else:
+                value = structural_key(value)
+            items.append((key, value))
+        return frozenset(items)
+
+    if isinstance(fields, (list, tuple)):
+        # frozen lists (see ``freeze``) are lists
+        return (isinstance(fields, list) and list or tuple,) + tuple(
+            map(structural_key, fields))
+
+    if isinstance(fields, basestring):
+        return fields
+
+    # the ``required`` and ``upload`` factories create a new class on
+    # each call; these are identified by their arguments
+    if isinstance(fields, type):
+        attributes = fields.__dict__
+        if 'wrapped' in attributes:
+            return ('required', structural_key(fields.wrapped), fields.msg)
+        if 'max_size' in attributes and issubclass(fields, FileUpload) \
+               and fields is not FileUpload:
+            return ('upload', fields.max_size)
+
+    # the compiled schema references the field type, such that the
+    # identity is not reused while the entry exists
+    return id(fields)
+
+
+cache = LRUCache()
+
+
+def get_schema(fields):
+    """Return compiled schema for ``fields`` from the default cache."""
+
+    if isinstance(fields, Schema):
+        return fields
+    return cache.get(fields)
@@ -0,0 +1,384 @@
+"""Capture and replay of form input.
+
+A ``Capture`` is an observer (see ``instrument``) which records the
+input parameters of forms to a local file; ``replay`` runs recorded
+input through the same form classes offline and reports timings and
+allocations per form class. This allows measuring changes against
+input of the shape seen in production (see ``benchmarks/replay.py``).
+
+Each record is a marshalled tuple ``(VERSION, name, prefix, params)``,
+where ``name`` is the dotted name of the form class. Values that are
+not of a basic type (e.g. file uploads) are recorded as ``None``."""
+
+import gc
+import re
+import math
+import random
+import marshal
+import threading
+
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import sha as sha1
+
+from repoze.formapi.instrument import Observer
+from repoze.formapi.instrument import field_name
+from repoze.formapi.instrument import timer
+
+VERSION = 1
+
+basic_types = (type(None), bool, int, long, float, str, unicode)
+
+re_digit = re.compile(r'\d', re.UNICODE)
+re_letter = re.compile(r'[^\W\d_]', re.UNICODE)
+
+
+class Capture(Observer):
+    """Records the input of a fraction ``rate`` of the forms to the
+    file ``path``; at most ``limit`` records are written.
+
+    Values of the fields named in ``redact`` are masked and those in
+    ``hash`` are replaced with a digest; names are dotted, with an
+    asterisk for dynamic keys (as in ``instrument``). If ``redact``
+    is true (rather than a sequence), all values are masked.
+
+        >>> import os, tempfile
+        >>> fd, path = tempfile.mkstemp()
+        >>> os.close(fd)
+
+        >>> from repoze.formapi import instrument
+        >>> from repoze.formapi.capture import Capture
+        >>> capture = Capture(
+        ...     path, redact=('email', 'cards.*.number'), hash=('account',))
+        >>> instrument.install(capture)
+
+        >>> class SignupForm(Form):
+        ...     fields = {
+        ...         'email': unicode, 'account': str, 'age': int,
+        ...         'cards': {str: {'number': str}}}
+        ...     prefix = 'signup'
+
+        >>> form = SignupForm(params=(
+        ...     ('email', u'fred@example.com'), ('account', 'fred'),
+        ...     ('age', '42'), ('cards.visa.number', '4111-1111'),
+        ...     ('signup.save', '')))
+        >>> form = SignupForm(params={'age': 41, 'account': 'wilma'})
+
+    Parameters that are given as an iterator are recorded too; the form
+    still receives them.
+
+        >>> form = SignupForm(params=iter((
+        ...     ('age', '40'), ('signup', ''))))
+        >>> form.data['age']
+        40
+
+        >>> form = SignupForm(params={
+        ...     'account': 1234,
+        ...     'cards': {'visa': {'number': 4111111111111111}}})
+
+        >>> instrument.uninstall()
+
+    Masked values keep their length and character classes: letters
+    are replaced with ``x`` and digits with ``0``. Hashed values are
+    replaced with a digest, such that equal values remain equal.
+
+        >>> from repoze.formapi.capture import load
+        >>> records = load(path)
+        >>> name, prefix, params = records[0]
+        >>> name, prefix
+        ('...SignupForm', 'signup')
+
+        >>> params
+        (('email', u'xxxx@xxxxxxx.xxx'), ('account', '...'), ('age', '42'),
+         ('cards.visa.number', '0000-0000'), ('signup.save', ''))
+
+        >>> sorted(records[1][2].items())
+        [('account', '...'), ('age', 41)]
+
+    Values that are not strings (e.g. numbers of JSON input) are masked
+    and hashed as text.
+
+        >>> records[3][2]['cards']
+        {'visa': {'number': '0000000000000000'}}
+
+        >>> from repoze.formapi.capture import digest
+        >>> records[3][2]['account'] == digest(1234)
+        True
+
+        >>> records[2][2]
+        (('age', '40'), ('signup', ''))
+
+        >>> params[1][1] == Capture(path, hash=('account',)).filter(
+        ...     SignupForm, ('account',), 'fred')
+        True
+
+        >>> os.remove(path)
+
+    """
+
+    def __init__(self, path, rate=1.0, redact=(), hash=(), salt='',
+                 limit=None):
+        self.path = path
+        self.rate = rate
+        self.redact = redact
+        self.hash = hash
+        self.salt = salt
+        self.limit = limit
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def start(self, form):
+        if self.limit is not None and self.count >= self.limit:
+            return None
+        if random.random() >= self.rate:
+            return None
+        return Recording(self, type(form))
+
+    def record(self, form_class, params, prefix):
+        """Append a record of the input ``params``."""
+
+        if isinstance(params, dict):
+            params = self.filter(form_class, (), params)
+        else:
+            params = tuple([
+                (name, self.filter(
+                    form_class, tuple(name.split('.')), value))
+                for (name, value) in params])
+
+        name = '%s.%s' % (form_class.__module__, form_class.__name__)
+        data = marshal.dumps((VERSION, name, prefix, params))
+
+        self.lock.acquire()
+        try:
+            if self.limit is not None and self.count >= self.limit:
+                return
+            f = open(self.path, 'ab')
+            try:
+                f.write(data)
+            finally:
+                f.close()
+            self.count += 1
+        finally:
+            self.lock.release()
+
+    def filter(self, form_class, path, value):
+        """Return the value to record for the input ``value``."""
+
+        if isinstance(value, dict):
+            return dict([
+                (key, self.filter(form_class, path + (key,), item))
+                for (key, item) in value.items()])
+        if isinstance(value, (list, tuple)):
+            return [self.filter(form_class, path, item) for item in value]
+        if not isinstance(value, basic_types):
+            return None
+
+        if value is not None and (self.redact or self.hash):
+            name = field_name(form_class, path)
+            if self.redact is True or name in self.redact:
+                return mask(value)
+            if name in self.hash:
+                return digest(value, self.salt)
+        return value
+
+
+class Recording(Observer):
+    """Records the input of a single form."""
+
+    def __init__(self, capture, form_class):
+        self.capture = capture
+        self.form_class = form_class
+
+    def params(self, params, prefix):
+        self.capture.record(self.form_class, params, prefix)
+
+
+class Statistics(object):
+    """Timings and allocations of the replayed input of a form
+    class; durations are in seconds."""
+
+    def __init__(self, name):
+        self.name = name
+        self.durations = []
+        self.objects = None
+
+    @property
+    def count(self):
+        return len(self.durations)
+
+    @property
+    def total(self):
+        return sum(self.durations)
+
+    @property
+    def throughput(self):
+        """Forms per second."""
+
+        total = self.total
+        if not total:
+            return None
+        return self.count / total
+
+    def percentile(self, percent):
+        """Return the duration below which ``percent`` of the
+        durations fall (nearest rank)."""
+
+        durations = sorted(self.durations)
+        if not durations:
+            return None
+        rank = int(math.ceil(percent / 100.0 * len(durations))) - 1
+        return durations[max(0, min(rank, len(durations) - 1))]
+
+
+def load(path):
+    """Return the records of the capture file ``path`` as a list of
+    ``(name, prefix, params)`` tuples. A truncated last record (e.g.
+    of a process that was killed while writing) is ignored."""
+
+    records = []
+    f = open(path, 'rb')
+    try:
+        while True:
+            try:
+                record = marshal.load(f)
+            except (EOFError, ValueError, TypeError):
+                break
+            if record[0] != VERSION:
+                raise ValueError(
+                    "Unsupported capture version: %r." % (record[0],))
+            records.append(record[1:])
+    finally:
+        f.close()
+    return records
+
+
+def resolve(name):
+    """Return the form class for its dotted name."""
+
+    module, attr = name.rsplit('.', 1)
+    return getattr(__import__(module, {}, {}, [attr]), attr)
+
+
+def process(form_class, prefix, params, call=False):
+    """Construct and validate a form; the submitted action is called
+    only if ``call`` is true (actions may have side effects)."""
+
+    form = form_class(params=params, prefix=prefix)
+    if form.validate() and call:
+        form()
+    return form
+
+
+def replay(records, resolve=resolve, repeat=1, call=False):
+    """Replay ``records`` (see ``load``) ``repeat`` times and return a
+    list of ``Statistics``, one for each form class, ordered by name.
+
+    The allocations are the number of objects tracked by the garbage
+    collector that are reachable from a processed form.
+
+        >>> class TapeForm(Form):
+        ...     fields = {'title': unicode, 'year': int}
+
+        >>> from repoze.formapi.capture import replay, report
+        >>> records = [
+        ...     ('tapes.TapeForm', None, (('title', u'Moonmadness'),)),
+        ...     ('tapes.TapeForm', None, (('year', 'late'),))]
+        >>> statistics, = replay(
+        ...     records, resolve=lambda name: TapeForm, repeat=5)
+
+        >>> statistics.name, statistics.count
+        ('tapes.TapeForm', 10)
+
+        >>> statistics.percentile(50) <= statistics.percentile(99)
+        True
+
+        >>> print report([statistics])
+        form class        count     forms/s   p50 us   p90 us   p99 us   objs/form
+        tapes.TapeForm       10 ...
+
+    """
+
+    groups = {}
+    for name, prefix, params in records:
+        groups.setdefault(name, []).append((prefix, params))
+
+    result = []
+    for name in sorted(groups):
+        form_class = resolve(name)
+        inputs = groups[name]
+
+        statistics = Statistics(name)
+        durations = statistics.durations
+        for i in xrange(repeat):
+            for prefix, params in inputs:
+                started = timer()
+                process(form_class, prefix, params, call)
+                durations.append(timer() - started)
+
+        statistics.objects = allocations(form_class, inputs, call)
+        result.append(statistics)
+
+    return result
+
+
+def allocations(form_class, inputs, call=False):
+    """Return the number of objects per processed form."""
+
+    enabled = gc.isenabled()
+    gc.collect()
+    gc.disable()
+    try:
+        before = len(gc.get_objects())
+        forms = [process(form_class, prefix, params, call)
+                 for (prefix, params) in inputs]
+        objects = len(gc.get_objects()) - before - 1
+    finally:
+        if enabled:
+            gc.enable()
+
+    return objects / float(len(forms))
+
+
+def report(statistics):
+    """Return the statistics as text."""
+
+    width = max([16] + [len(entry.name) for entry in statistics])
+    lines = ["%-*s %7s %11s %8s %8s %8s %11s" % (
+        width, "form class", "count", "forms/s", "p50 us", "p90 us",
+        "p99 us", "objs/form")]
+    for entry in statistics:
+        lines.append("%-*s %7d %11.1f %8.1f %8.1f %8.1f %11.1f" % (
+            width, entry.name, entry.count, entry.throughput or 0,
+            entry.percentile(50) * 1e6, entry.percentile(90) * 1e6,
+            entry.percentile(99) * 1e6, entry.objects))
+    return "\n".join(lines)
+
+
+def mask(value):
+    """Return ``value`` with letters replaced with ``x`` and digits
+    with ``0``; values that are not strings are masked as text.
+
+        >>> from repoze.formapi.capture import mask
+        >>> mask(u'Fred Flintstone, 1960-09-30')
+        u'xxxx xxxxxxxxxx, 0000-00-00'
+
+        >>> mask(4111111111111111), mask(True)
+        ('0000000000000000', 'xxxx')
+
+    """
+
+    if not isinstance(value, basestring):
+        value = repr(value)
+    return re_letter.sub('x', re_digit.sub('0', value))
+
+
+def digest(value, salt=''):
+    """Return a digest of ``value`` (of the same string type; values
+    that are not strings are hashed as text)."""
+
+    if isinstance(value, unicode):
+        return unicode(sha1(salt + value.encode('utf-8')).hexdigest()[:16])
+    if not isinstance(value, str):
+        value = repr(value)
+    return sha1(salt + value).hexdigest()[:16]
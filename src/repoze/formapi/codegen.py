@@ -0,0 +1,305 @@
+import sys
+
+from repoze.formapi.error import Errors
+from repoze.formapi.parser import Parser
+from repoze.formapi.parser import MissingError
+from repoze.formapi.parser import parse as generic_parse
+from repoze.formapi.cache import get_schema
+
+dynamic_keys = (str, unicode, int)
+
+
+def parse(params, fields, observer=None, lazy=False, repeated=None):
+    """Drop-in replacement for ``parse`` which uses a parse function
+    that is generated for the fields definition (see
+    ``compile_parser``).
+
+        >>> from repoze.formapi.codegen import parse
+        >>> data, errors = parse(
+        ...     (('title', u'Moonmadness'), ('year', 'late')),
+        ...     {'title': unicode, 'year': int})
+
+        >>> data['title']
+        u'Moonmadness'
+
+        >>> errors['year'][0]
+        "invalid literal for int() with base 10: 'late'"
+
+    Nested dictionaries, JSON input, instrumented, lazy parsing and
+    a policy for repeated values are handled by the generic parser.
+    """
+
+    if observer is not None or lazy or repeated is not None or \
+           isinstance(params, dict) or hasattr(params, 'read'):
+        return generic_parse(params, fields, observer, lazy, repeated)
+
+    return get_parser(fields)(params, fields)
+
+
+def get_parser(fields):
+    """Return the generated parse function for ``fields``; the
+    function is kept with the compiled schema (see ``cache``)."""
+
+    schema = get_schema(fields)
+    parser = schema.__dict__.get('parser')
+    if parser is None:
+        parser = schema.parser = compile_parser(schema.fields)
+    return parser
+
+
+def compile_parser(fields):
+    """Return a parse function specialized for ``fields``.
+
+    The function takes a sequence of ``(name, value)`` pairs and an
+    optional fields definition (the one that the returned parser
+    object should refer to) and returns ``(data, errors)`` exactly like
+    ``parse``.
+
+    Parameters with a static name (no dynamic keys) are dispatched
+    directly to generated code with the conversion inlined; other
+    parameters are handled by the generic parser.
+
+        >>> from repoze.formapi.codegen import compile_parser
+        >>> parse_tape = compile_parser({
+        ...     'title': required(unicode),
+        ...     'tags': [str],
+        ...     'tracks': {str: int}})
+
+        >>> data, errors = parse_tape((
+        ...     ('title', u''), ('tags', 'prog'), ('tags', 'rock'),
+        ...     ('tracks.a1', '190')))
+
+        >>> data['tags'], data['tracks']['a1']
+        (['prog', 'rock'], 190)
+
+        >>> errors['title'][0]
+        'Required field'
+
+    The generated source is available for inspection.
+
+        >>> print parse_tape.source
+        def parse(params, fields=fields):
+            data = {}
+            errors = Errors()
+            parser = Parser(fields, data)
+            parser.buffer()
+            buffers = parser.buffers
+            for name, value in params:
+                code = lookup(name)
+                if code is None:
+        ...
+
+    """
+
+    endpoints = sorted(iter_endpoints(fields, ()))
+
+    namespace = {
+        'fields': fields,
+        'Errors': Errors,
+        'Parser': Parser,
+        'MissingError': MissingError,
+        'ValueError': ValueError,
+        'KeyError': KeyError,
+        'exc_info': sys.exc_info,
+        'lookup': dict([
+            (name, code) for (code, (name, path, field))
+            in enumerate(endpoints)]).get,
+        }
+
+    lines = [
+        "def parse(params, fields=fields):",
+        "    data = {}",
+        "    errors = Errors()",
+        "    parser = Parser(fields, data)",
+        "    parser.buffer()",
+        "    buffers = parser.buffers",
+        "    for name, value in params:",
+        "        code = lookup(name)",
+        "        if code is None:",
+        ]
+    emit_fallback(lines, 3)
+
+    blocks = []
+    for code, (name, path, field) in enumerate(endpoints):
+        convert = 'c%d' % code
+        constant = 'p%d' % code
+        if isinstance(field, (list, tuple)):
+            namespace[convert] = field[0]
+        else:
+            namespace[convert] = field
+        namespace[constant] = path
+
+        block = []
+        # the path tuple is constant for string names; for unicode
+        # names it is derived from the name (like the generic parser)
+        if all_str(path):
+            block.append("if name.__class__ is str:")
+            block.append("    path = %s" % constant)
+            block.append("else:")
+            block.append("    path = tuple(name.split('.'))")
+        else:
+            block.append("path = tuple(name.split('.'))")
+
+        if isinstance(field, list):
+            emit_list(block, convert)
+        elif isinstance(field, tuple):
+            emit_tuple(block, convert)
+        else:
+            emit_value(block, convert)
+
+        emit_report(block)
+        blocks.append(block)
+
+    emit_dispatch(lines, blocks, 0, len(blocks), 2)
+    lines.append("    parser.finalize()")
+    lines.append("    return parser, errors")
+
+    source = "\n".join(lines) + "\n"
+    exec compile(source, '<parser>', 'exec') in namespace
+    function = namespace['parse']
+    function.source = source
+    return function
+
+
+def iter_endpoints(fields, path):
+    """Yield ``(name, path, field)`` for the end-points that can be
+    reached with a static name."""
+
+    if len(fields) == 1 and fields.keys()[0] in dynamic_keys:
+        return
+
+    for key, value in fields.items():
+        # keys that contain a dot can not be addressed by name
+        if not isinstance(key, basestring) or '.' in key:
+            continue
+        if isinstance(value, dict):
+            for item in iter_endpoints(value, path + (key,)):
+                yield item
+        else:
+            keys = path + (key,)
+            yield '.'.join(keys), keys, value
+
+
+def all_str(path):
+    for key in path:
+        if type(key) is not str:
+            return False
+    return True
+
+
+def emit_dispatch(lines, blocks, start, end, level):
+    """Emit a binary search over the dispatch code."""
+
+    indent = "    " * level
+    if end - start == 1:
+        for line in blocks[start]:
+            lines.append(indent + line)
+        return
+
+    middle = (start + end) / 2
+    lines.append(indent + "if code < %d:" % middle)
+    emit_dispatch(lines, blocks, start, middle, level + 1)
+    lines.append(indent + "else:")
+    emit_dispatch(lines, blocks, middle, end, level + 1)
+
+
+def emit_fallback(lines, level):
+    indent = "    " * level
+    for line in (
+        "path = tuple(name.split('.'))",
+        "try:",
+        "    parser[path] = value",
+        "except KeyError:",
+        "    continue",
+        "except ValueError, error:",
+        "    e = errors",
+        "    for p in path:",
+        "        e = e[p]",
+        "    e += str(error)",
+        "continue",
+        ):
+        lines.append(indent + line)
+
+
+def emit_value(block, convert):
+    block.extend((
+        "error = None",
+        "if value is not None:",
+        "    try:",
+        "        value = %s(value)" % convert,
+        "    except KeyError:",
+        "        continue",
+        "    except MissingError:",
+        "        error = exc_info()",
+        "        value = None",
+        "    except:",
+        "        if value:",
+        "            error = exc_info()",
+        "        else:",
+        "            value = None",
+        "data[path] = value",
+        "if value is not None:",
+        "    data[None] = True",
+        ))
+
+
+def emit_sequence(block, convert):
+    block.extend((
+        "error = None",
+        "if isinstance(value, (tuple, list)):",
+        "    if path in data:",
+        "        del data[path]",
+        "else:",
+        "    value = (value,)",
+        "items = []",
+        "for v in value:",
+        "    if v is not None:",
+        "        try:",
+        "            v = %s(v)" % convert,
+        "        except:",
+        "            error = exc_info()",
+        "    items.append(v)",
+        ))
+
+
+def emit_list(block, convert):
+    emit_sequence(block, convert)
+    block.extend((
+        "if items:",
+        "    if path in data:",
+        "        data[path].extend(items)",
+        "    else:",
+        "        data[path] = items",
+        "data[None] = True",
+        ))
+
+
+def emit_tuple(block, convert):
+    emit_sequence(block, convert)
+    block.extend((
+        "if items:",
+        "    current = data.get(path)",
+        "    if current is not None and path in buffers:",
+        "        current.extend(items)",
+        "    else:",
+        "        if current is not None:",
+        "            items[:0] = current",
+        "        data[path] = items",
+        "        buffers.add(path)",
+        "data[None] = True",
+        ))
+
+
+def emit_report(block):
+    block.extend((
+        "if error is not None:",
+        "    if isinstance(error[1], KeyError):",
+        "        continue",
+        "    if not isinstance(error[1], ValueError):",
+        "        raise error[0], error[1], error[2]",
+        "    e = errors",
+        "    for p in path:",
+        "        e = e[p]",
+        "    e += str(error[1])",
+        "continue",
+        ))
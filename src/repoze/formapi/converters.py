@@ -0,0 +1,628 @@
+"""Common field types.
+
+Each field type is a class that converts the input in its
+constructor, such that it can be wrapped with ``required``;
+configurable types are created with a factory function (like
+``upload``). Patterns are compiled once, at import time or when the
+field type is created, never per value. Invalid input raises a
+``ValueError`` with a message suitable for display.
+
+Field types define a ``serialize`` method which is used by ``encode``
+to format values."""
+
+import re
+import datetime
+import threading
+
+from decimal import Decimal
+from decimal import InvalidOperation
+from decimal import ROUND_HALF_EVEN
+
+re_date = re.compile(r'(\d{4})-(\d\d)-(\d\d)$')
+re_datetime = re.compile(
+    r'(\d{4})-(\d\d)-(\d\d)(?:[T ](\d\d):(\d\d)(?::(\d\d)(?:\.(\d{1,6}))?)?)?'
+    r'(Z|[+-]\d\d:?\d\d)?$')
+re_email = re.compile(
+    r"[\w!#$%&'*+/=?^`{|}~-]+(?:\.[\w!#$%&'*+/=?^`{|}~-]+)*"
+    r"@(?:[a-z0-9](?:[a-z0-9-]*[a-z0-9])?\.)+[a-z]{2,}$",
+    re.IGNORECASE | re.UNICODE)
+
+# number formatting conventions ``(decimal point, group separator)``
+# by language or locale
+conventions = {
+    'en': ('.', ','),
+    'ja': ('.', ','),
+    'zh': ('.', ','),
+    'de': (',', '.'),
+    'da': (',', '.'),
+    'es': (',', '.'),
+    'it': (',', '.'),
+    'nl': (',', '.'),
+    'pt': (',', '.'),
+    'fr': (',', u'\xa0'),
+    'fi': (',', u'\xa0'),
+    'nb': (',', u'\xa0'),
+    'pl': (',', u'\xa0'),
+    'ru': (',', u'\xa0'),
+    'sv': (',', u'\xa0'),
+    'de_CH': ('.', "'"),
+    }
+
+# compiled number patterns by convention
+number_patterns = {}
+
+
+class FixedOffset(datetime.tzinfo):
+    """Fixed offset (in minutes) from UTC."""
+
+    def __init__(self, minutes):
+        self.minutes = minutes
+        self.offset = datetime.timedelta(minutes=minutes)
+
+    def __repr__(self):
+        sign = self.minutes < 0 and '-' or '+'
+        minutes = abs(self.minutes)
+        return '<%s %s%02d:%02d>' % (
+            type(self).__name__, sign, minutes / 60, minutes % 60)
+
+    def __reduce__(self):
+        return type(self), (self.minutes,)
+
+    def utcoffset(self, dt):
+        return self.offset
+
+    def dst(self, dt):
+        return datetime.timedelta(0)
+
+    def tzname(self, dt):
+        return None
+
+
+UTC = FixedOffset(0)
+
+
+class isodate(object):
+    """ISO 8601 date (``YYYY-MM-DD``).
+
+        >>> from repoze.formapi.converters import isodate
+        >>> isodate('1975-09-01')
+        datetime.date(1975, 9, 1)
+
+        >>> isodate('1975-09-31')
+        Traceback (most recent call last):
+         ...
+        ValueError: day is out of range for month
+
+        >>> isodate('01/09/1975')
+        Traceback (most recent call last):
+         ...
+        ValueError: Invalid date (expected YYYY-MM-DD).
+
+        >>> isodate.serialize(isodate('1975-09-01'))
+        u'1975-09-01'
+
+    """
+
+    def __new__(cls, value):
+        if isinstance(value, datetime.date):
+            return value
+        m = re_date.match(value.strip())
+        if m is None:
+            raise ValueError("Invalid date (expected YYYY-MM-DD).")
+        year, month, day = m.groups()
+        return datetime.date(int(year), int(month), int(day))
+
+    @staticmethod
+    def serialize(value):
+        # input that did not convert is kept as text
+        if isinstance(value, basestring):
+            return value
+        return unicode(value.isoformat())
+
+
+class isodatetime(object):
+    """ISO 8601 date and time. Seconds, fractions and a UTC offset are
+    optional; without an offset, the value is naive.
+
+        >>> from repoze.formapi.converters import isodatetime
+        >>> isodatetime('1975-09-01T20:15')
+        datetime.datetime(1975, 9, 1, 20, 15)
+
+        >>> isodatetime('1975-09-01 20:15:30.5+02:00')
+        datetime.datetime(1975, 9, 1, 20, 15, 30, 500000,
+                          tzinfo=<FixedOffset +02:00>)
+
+        >>> isodatetime('1975-09-01T20:15:30Z').utcoffset()
+        datetime.timedelta(0)
+
+        >>> isodatetime('1975-09-01T25:00')
+        Traceback (most recent call last):
+         ...
+        ValueError: hour must be in 0..23
+
+        >>> isodatetime.serialize(isodatetime('1975-09-01T20:15Z'))
+        u'1975-09-01T20:15:00+00:00'
+
+    """
+
+    def __new__(cls, value):
+        if isinstance(value, datetime.datetime):
+            return value
+        m = re_datetime.match(value.strip())
+        if m is None:
+            raise ValueError(
+                "Invalid date and time (expected YYYY-MM-DDTHH:MM:SS).")
+        year, month, day, hour, minute, second, fraction, offset = \
+              m.groups()
+
+        if fraction:
+            fraction = int(fraction.ljust(6, '0'))
+        else:
+            fraction = 0
+
+        tzinfo = None
+        if offset == 'Z':
+            tzinfo = UTC
+        elif offset:
+            minutes = int(offset[1:3]) * 60 + int(offset[-2:])
+            if offset[0] == '-':
+                minutes = -minutes
+            tzinfo = FixedOffset(minutes)
+
+        return datetime.datetime(
+            int(year), int(month), int(day), int(hour or 0),
+            int(minute or 0), int(second or 0), fraction, tzinfo)
+
+    @staticmethod
+    def serialize(value):
+        # input that did not convert is kept as text
+        if isinstance(value, basestring):
+            return value
+        return unicode(value.isoformat())
+
+
+class boolean(object):
+    """Boolean input, e.g. from a checkbox or a select box.
+
+        >>> from repoze.formapi.converters import boolean
+        >>> boolean('on'), boolean('Yes'), boolean('0'), boolean('')
+        (True, True, False, False)
+
+        >>> boolean('maybe')
+        Traceback (most recent call last):
+         ...
+        ValueError: Invalid boolean value.
+
+    """
+
+    true = frozenset(('1', 'on', 'true', 'yes', 'y', 't'))
+    false = frozenset(('', '0', 'off', 'false', 'no', 'n', 'f'))
+
+    def __new__(cls, value):
+        if value is True or value is False:
+            return value
+        value = value.strip().lower()
+        if value in cls.true:
+            return True
+        if value in cls.false:
+            return False
+        raise ValueError("Invalid boolean value.")
+
+    @staticmethod
+    def serialize(value):
+        if isinstance(value, basestring):
+            return value
+        return value and u'1' or u''
+
+
+class email(unicode):
+    """E-mail address; surrounding whitespace is stripped.
+
+        >>> from repoze.formapi.converters import email
+        >>> email(' fred@example.com ')
+        u'fred@example.com'
+
+        >>> email('fred@example')
+        Traceback (most recent call last):
+         ...
+        ValueError: Invalid e-mail address.
+
+    """
+
+    def __new__(cls, value):
+        value = unicode(value).strip()
+        if re_email.match(value) is None:
+            raise ValueError("Invalid e-mail address.")
+        return value
+
+
+def string(min_length=None, max_length=None, strip=True):
+    """Return a field type for unicode strings of bounded length.
+
+        >>> from repoze.formapi.converters import string
+        >>> name = string(min_length=2, max_length=8)
+        >>> name(' Fred ')
+        u'Fred'
+
+        >>> name('Frederick Kaputnik')
+        Traceback (most recent call last):
+         ...
+        ValueError: Must be at most 8 characters.
+
+        >>> name('F')
+        Traceback (most recent call last):
+         ...
+        ValueError: Must be at least 2 characters.
+
+    """
+
+    class string(unicode):
+        def __new__(cls, value):
+            value = unicode(value)
+            if strip:
+                value = value.strip()
+            length = len(value)
+            if max_length is not None and length > max_length:
+                raise ValueError(
+                    "Must be at most %d characters." % max_length)
+            if min_length is not None and length < min_length:
+                raise ValueError(
+                    "Must be at least %d characters." % min_length)
+            return value
+
+    string.min_length = min_length
+    string.max_length = max_length
+    return string
+
+
+def decimal(places=None, rounding=ROUND_HALF_EVEN):
+    """Return a field type for decimal numbers, optionally rounded to
+    a number of decimal ``places``.
+
+        >>> from repoze.formapi.converters import decimal
+        >>> price = decimal(places=2)
+        >>> price('12.345')
+        Decimal('12.34')
+
+        >>> price('12,50')
+        Traceback (most recent call last):
+         ...
+        ValueError: Invalid decimal number.
+
+        >>> price.serialize(price('7'))
+        u'7.00'
+
+    """
+
+    if places is not None:
+        exponent = Decimal(1).scaleb(-places)
+    else:
+        exponent = None
+
+    class decimal(Decimal):
+        def __new__(cls, value):
+            if isinstance(value, float):
+                value = repr(value)
+            try:
+                value = Decimal(value.strip())
+            except (InvalidOperation, AttributeError):
+                if isinstance(value, (int, long, Decimal)):
+                    value = Decimal(value)
+                else:
+                    raise ValueError("Invalid decimal number.")
+            if not value.is_finite():
+                raise ValueError("Invalid decimal number.")
+            if exponent is not None:
+                value = value.quantize(exponent, rounding)
+            return value
+
+        @staticmethod
+        def serialize(value):
+            if isinstance(value, basestring):
+                return value
+            if exponent is not None:
+                value = value.quantize(exponent, rounding)
+            return unicode(value)
+
+    decimal.places = places
+    return decimal
+
+
+def number(locale='en', type=float):
+    """Return a field type for numbers formatted according to the
+    conventions of ``locale`` (see ``conventions``); ``type`` is the
+    numeric type of the value (e.g. ``int`` or ``Decimal``).
+
+        >>> from repoze.formapi.converters import number
+        >>> amount = number('de_DE')
+        >>> amount('1.234,5')
+        1234.5
+
+        >>> amount('1,234.5')
+        Traceback (most recent call last):
+         ...
+        ValueError: Invalid number.
+
+        >>> amount.serialize(1234567.5)
+        u'1.234.567,5'
+
+        >>> count = number('fr', int)
+        >>> count(u'1\\u00a0234')
+        1234
+
+    Group separators are optional, but must be placed correctly.
+
+        >>> count('1234'), count('1 234')
+        (1234, 1234)
+
+        >>> count('12 34')
+        Traceback (most recent call last):
+         ...
+        ValueError: Invalid number.
+
+    """
+
+    point, separator = get_conventions(locale)
+    pattern = get_number_pattern(point, separator)
+    integral = type in (int, long)
+
+    class number(object):
+        def __new__(cls, value):
+            if isinstance(value, (int, long, float, Decimal)):
+                return type(value)
+            m = pattern.match(value.strip())
+            if m is None or integral and m.group(3):
+                raise ValueError("Invalid number.")
+            sign, digits, fraction = m.groups()
+            digits = digits.replace(separator, '').replace(' ', '')
+            if fraction:
+                digits += '.' + fraction
+            return type(sign + digits)
+
+        @staticmethod
+        def serialize(value):
+            if isinstance(value, basestring):
+                return value
+            return format_number(value, point, separator)
+
+    number.locale = locale
+    return number
+
+
+class Choices(object):
+    """Index of the options of a choice field (see ``choice``), which
+    maps submitted text to values in constant time.
+
+    Options are a mapping or a sequence of ``(key, value)`` tuples,
+    where the key is the submitted text; other items are values keyed
+    by their text. The options may instead be loaded on first use by
+    calling ``load``.
+
+        >>> from repoze.formapi.converters import Choices
+        >>> countries = Choices(load=lambda: [
+        ...     ('dk', u'Denmark'), ('se', u'Sweden')])
+
+        >>> countries.lookup('dk')
+        u'Denmark'
+
+        >>> countries.lookup('no')
+        Traceback (most recent call last):
+         ...
+        ValueError: Invalid choice.
+
+    The index is never changed in place; ``refresh`` replaces it,
+    with the given options or by calling ``load`` again.
+
+        >>> countries.refresh([('no', u'Norway')])
+        >>> countries.lookup('no'), 'dk' in countries
+        (u'Norway', False)
+
+    Values are accepted as well (e.g. from a JSON document).
+
+        >>> ids = Choices([1, 2, 3])
+        >>> ids.lookup(u'2'), ids.lookup(3)
+        (2, 3)
+
+        >>> ids.key(2)
+        u'2'
+
+    """
+
+    def __init__(self, options=None, load=None):
+        self.load = load
+        self.lock = threading.Lock()
+
+        # the index and the keys of values, replaced as a pair
+        self.state = None
+        if options is not None:
+            self.refresh(options)
+        elif load is None:
+            raise ValueError("Either options or a loader must be given.")
+
+    def __len__(self):
+        return len(self.get_state()[0])
+
+    def __contains__(self, value):
+        try:
+            self.lookup(value)
+        except ValueError:
+            return False
+        return True
+
+    def refresh(self, options=None):
+        """Replace the options; if not given, they're loaded."""
+
+        if options is None:
+            if self.load is None:
+                raise ValueError("Options can not be loaded.")
+            options = self.load()
+        self.state = index_options(options)
+
+    def get_state(self):
+        state = self.state
+        if state is None:
+            self.lock.acquire()
+            try:
+                state = self.state
+                if state is None:
+                    self.refresh()
+                    state = self.state
+            finally:
+                self.lock.release()
+        return state
+
+    def lookup(self, value):
+        """Return the value for the submitted text ``value``."""
+
+        index, keys = self.get_state()
+        try:
+            return index[value]
+        except (KeyError, TypeError):
+            pass
+
+        if isinstance(value, str):
+            try:
+                return index[value.decode('utf-8')]
+            except (KeyError, UnicodeError):
+                pass
+        else:
+            try:
+                if value in keys:
+                    return value
+            except TypeError:
+                pass
+        raise ValueError("Invalid choice.")
+
+    def key(self, value):
+        """Return the text for ``value``."""
+
+        try:
+            key = self.get_state()[1].get(value)
+        except TypeError:
+            key = None
+        if key is None:
+            return unicode(value)
+        return key
+
+
+def choice(options=None, load=None):
+    """Return a field type for a choice among ``options``; the
+    arguments are those of ``Choices``. An index may be passed
+    instead, to share it between fields.
+
+        >>> from repoze.formapi.converters import choice, Choices
+        >>> skus = Choices(('TAPE-%04d' % i, i) for i in range(5000))
+
+        >>> class OrderForm(Form):
+        ...     fields = {
+        ...         'item': required(choice(skus)),
+        ...         'extras': [choice(skus)],
+        ...         'size': choice(['S', 'M', 'L'])}
+
+        >>> form = OrderForm(params=(
+        ...     ('item', 'TAPE-0042'), ('extras', 'TAPE-0001'),
+        ...     ('extras', 'TAPE-0002'), ('size', 'XL')))
+
+        >>> form.data['item'], form.data['extras']
+        (42, [1, 2])
+
+        >>> form.errors['size'][0]
+        'Invalid choice.'
+
+        >>> OrderForm.fields['extras'][0].serialize(2)
+        u'TAPE-0002'
+
+    """
+
+    if isinstance(options, Choices):
+        choices = options
+    else:
+        choices = Choices(options, load)
+
+    class choice(object):
+        def __new__(cls, value):
+            return choices.lookup(value)
+
+        @staticmethod
+        def serialize(value):
+            return choices.key(value)
+
+    choice.choices = choices
+    return choice
+
+
+def index_options(options):
+    """Return ``(index, keys)`` for options: the values by text and
+    the text of (hashable) values."""
+
+    if hasattr(options, 'items'):
+        options = options.items()
+
+    index = {}
+    keys = {}
+    for option in options:
+        if type(option) is tuple and len(option) == 2:
+            key, value = option
+        else:
+            key = value = option
+        if isinstance(key, str):
+            key = key.decode('utf-8')
+        elif not isinstance(key, unicode):
+            key = unicode(key)
+        index[key] = value
+        try:
+            keys.setdefault(value, key)
+        except TypeError:
+            pass
+    return index, keys
+
+
+def get_conventions(locale):
+    """Return ``(decimal point, group separator)`` for ``locale``;
+    a locale such as ``'de_AT'`` falls back to the language."""
+
+    locale = locale.replace('-', '_')
+    try:
+        return conventions[locale]
+    except KeyError:
+        try:
+            return conventions[locale.split('_')[0].lower()]
+        except KeyError:
+            raise ValueError("Unknown locale: %s." % locale)
+
+
+def get_number_pattern(point, separator):
+    key = point, separator
+    pattern = number_patterns.get(key)
+    if pattern is None:
+        # a non-breaking space separator also accepts a plain space
+        group = re.escape(separator)
+        if separator == u'\xa0':
+            group = u'[\xa0 ]'
+        pattern = re.compile(
+            u'([+-]?)(\\d{1,3}(?:%s\\d{3})+|\\d+)(?:%s(\\d+))?$' % (
+                group, re.escape(point)), re.UNICODE)
+        number_patterns[key] = pattern
+    return pattern
+
+
+def format_number(value, point, separator):
+    if isinstance(value, float):
+        text = unicode(repr(value))
+    else:
+        text = unicode(value)
+    sign = u''
+    if text.startswith(u'-'):
+        sign, text = u'-', text[1:]
+    digits, dot, fraction = text.partition(u'.')
+
+    groups = []
+    while len(digits) > 3:
+        groups.insert(0, digits[-3:])
+        digits = digits[:-3]
+    groups.insert(0, digits)
+
+    text = sign + separator.join(groups)
+    if fraction:
+        text += point + fraction
+    return text
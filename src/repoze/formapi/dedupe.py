@@ -0,0 +1,388 @@
+"""Duplicate submission detection.
+
+Identical submissions (e.g. a double-click or a client retry) within a
+time window are detected by a digest of the parameters that are
+relevant to the form: the names in its fields definition and its
+action parameters. Submissions are only compared within a scope (e.g.
+a session, user or context id) given by the caller. The outcome of the
+first submission is kept in a store and returned for duplicates,
+without parsing, validating or submitting the form again.
+
+The store interface is a subset of that of memcached clients: ``get``,
+``add``, ``set`` and ``delete``, with an expiry time in seconds. The
+default is an in-process ``MemoryStore``; a store which is shared
+between processes must be able to pickle outcomes."""
+
+import threading
+import time
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
+
+from repoze.formapi.form import Action
+from repoze.formapi.form import find_action_params
+from repoze.formapi.form import submits
+from repoze.formapi.parser import walk
+from repoze.formapi.wsgi import acceptor
+from repoze.formapi.wsgi import parse_environ
+from repoze.formapi.py24 import json
+
+# marks a submission that is still being processed
+PENDING = 'pending'
+
+
+class Submission(object):
+    """Outcome of a submission.
+
+    The ``errors`` attribute is a list of ``(path, message)`` tuples,
+    ``action`` is the name of the submitted action (or ``None``) and
+    ``status`` is the value returned by the action. For a duplicate
+    submission, ``duplicate`` is set and ``form`` is ``None``; if the
+    first submission is still being processed, ``pending`` is set and
+    there is no outcome yet."""
+
+    form = None
+    duplicate = False
+    pending = False
+
+    def __init__(self, status=None, errors=(), action=None):
+        self.status = status
+        self.errors = list(errors)
+        self.action = action
+
+    def __nonzero__(self):
+        return not self.errors
+
+    def __repr__(self):
+        return '<%s action=%r errors=%d%s>' % (
+            type(self).__name__, self.action, len(self.errors),
+            self.duplicate and ' duplicate' or '')
+
+    def __getstate__(self):
+        return self.status, self.errors, self.action
+
+    def __setstate__(self, state):
+        self.status, self.errors, self.action = state
+
+
+class Deduplicator(object):
+    """Submits forms, detecting duplicate submissions within
+    ``window`` seconds.
+
+        >>> class OrderForm(Form):
+        ...     fields = {'item': required(str), 'quantity': int}
+        ...     prefix = 'order'
+        ...     orders = []
+        ...
+        ...     @action('place')
+        ...     def place(self, data):
+        ...         self.orders.append(data['item'])
+        ...         return len(self.orders)
+
+        >>> from repoze.formapi.dedupe import Deduplicator
+        >>> deduplicator = Deduplicator(window=60)
+        >>> params = (
+        ...     ('item', 'tape'), ('quantity', '2'), ('order.place', ''),
+        ...     ('session', 'abc'))
+
+        >>> submission = deduplicator.submit(
+        ...     OrderForm, 'session-1', params=params)
+        >>> submission.status, submission.action, submission.duplicate
+        (1, 'place', False)
+
+    The form is available for rendering.
+
+        >>> submission.form.data['quantity']
+        2
+
+    A duplicate submission returns the outcome of the first one; the
+    action is not called again. Parameters that are not relevant to
+    the form (and the order of parameters with different names) do not
+    matter.
+
+        >>> submission = deduplicator.submit(OrderForm, 'session-1', params=(
+        ...     ('session', 'def'), ('quantity', '2'), ('item', 'tape'),
+        ...     ('order.place', '')))
+        >>> submission.status, submission.duplicate, submission.form
+        (1, True, None)
+
+        >>> OrderForm.orders
+        ['tape']
+
+    Forms that are rendered (no action is submitted) are never
+    duplicates.
+
+        >>> for i in range(2):
+        ...     submission = deduplicator.submit(OrderForm, 'session-1')
+        ...     print submission.duplicate, submission.form is not None
+        False True
+        False True
+
+    The same input in another scope is not a duplicate.
+
+        >>> submission = deduplicator.submit(
+        ...     OrderForm, 'session-2', params=params)
+        >>> submission.status, submission.duplicate
+        (2, False)
+
+    Errors are kept as well.
+
+        >>> params = (('item', ''), ('order.place', ''))
+        >>> deduplicator.submit(OrderForm, 'session-1', params=params).errors
+        [(('item',), u'Required field')]
+
+        >>> submission = deduplicator.submit(
+        ...     OrderForm, 'session-1', params=params)
+        >>> submission.errors, submission.duplicate
+        ([(('item',), u'Required field')], True)
+
+    """
+
+    def __init__(self, store=None, window=10):
+        if store is None:
+            store = MemoryStore()
+        self.store = store
+        self.window = window
+
+    def submit(self, form_class, scope, params=None, request=None,
+               environ=None, prefix=None, **kwargs):
+        """Submit the parameters (or request, or WSGI environment) to
+        ``form_class`` and return a ``Submission``; only submissions
+        with the same ``scope`` (e.g. a session or context id) are
+        duplicates. Other arguments are passed to the form
+        constructor."""
+
+        if scope is None:
+            raise ValueError("A scope is required.")
+
+        if prefix is None:
+            prefix = form_class.prefix
+
+        if request is not None:
+            params = request.params.items()
+        elif environ is not None:
+            # the request body can be read only once
+            params = parse_environ(environ, form_class.schema, prefix)
+        elif hasattr(params, 'read'):
+            params = json.load(params)
+        elif params is not None and not isinstance(params, dict):
+            params = list(params)
+
+        # only submissions of an action are deduplicated; a form that
+        # is rendered is always processed
+        action_params = find_action_params(params, prefix)
+        actions = [
+            Action(None, action.name, action.name in action_params)
+            for action in form_class.actions]
+        if not (filter(None, actions) or
+                action_params.get(None) is not None) or \
+               not submits(prefix, actions, action_params):
+            return self.process(form_class, params, prefix, kwargs)
+
+        key = digest(form_class, params, prefix, scope)
+        if key is None:
+            return self.process(form_class, params, prefix, kwargs)
+
+        store = self.store
+        if not store.add(key, PENDING, self.window):
+            outcome = store.get(key)
+            if outcome is not None:
+                submission = Submission()
+                submission.duplicate = True
+                if outcome == PENDING:
+                    submission.pending = True
+                else:
+                    submission.__setstate__(outcome)
+                return submission
+
+            # expired in the meantime
+            store.add(key, PENDING, self.window)
+
+        try:
+            submission = self.process(form_class, params, prefix, kwargs)
+        except:
+            store.delete(key)
+            raise
+
+        store.set(key, submission.__getstate__(), self.window)
+        return submission
+
+    def process(self, form_class, params, prefix, kwargs):
+        form = form_class(params=params, prefix=prefix, **kwargs)
+        if form.validate():
+            form()
+
+        action = form.action
+        if action is not None:
+            action = action.name
+
+        submission = Submission(
+            form.status,
+            [(path, unicode(message))
+             for (path, message) in form.errors.flatten()],
+            action)
+        submission.form = form
+        return submission
+
+
+class MemoryStore(object):
+    """In-process store of at most ``size`` entries; entries expire
+    after the time given when they're set.
+
+        >>> from repoze.formapi.dedupe import MemoryStore
+        >>> store = MemoryStore(size=2)
+        >>> store.add('a', 1, 60), store.add('a', 2, 60)
+        (True, False)
+
+        >>> store.set('b', 2, 60)
+        >>> store.set('c', 3, 60)
+        >>> store.get('a'), store.get('c')
+        (None, 3)
+
+        >>> store.set('c', 4, -1)
+        >>> store.get('c')
+
+    """
+
+    def __init__(self, size=1024):
+        self.size = size
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < time.time():
+            return None
+        return entry[1]
+
+    def add(self, key, value, expires):
+        """Set ``key`` unless it's already set; returns ``True`` if
+        the value was set."""
+
+        self.lock.acquire()
+        try:
+            if self.get(key) is not None:
+                return False
+            self.store(key, value, expires)
+            return True
+        finally:
+            self.lock.release()
+
+    def set(self, key, value, expires):
+        self.lock.acquire()
+        try:
+            self.store(key, value, expires)
+        finally:
+            self.lock.release()
+
+    def delete(self, key):
+        self.lock.acquire()
+        try:
+            self.entries.pop(key, None)
+        finally:
+            self.lock.release()
+
+    def store(self, key, value, expires):
+        entries = self.entries
+        now = time.time()
+        if key not in entries and len(entries) >= self.size:
+            # drop expired entries, then the ones that expire first
+            for k, entry in entries.items():
+                if entry[0] < now:
+                    del entries[k]
+            if len(entries) >= self.size:
+                items = sorted(entries.items(), key=lambda item: item[1][0])
+                for k, entry in items[:len(entries) - self.size + 1]:
+                    del entries[k]
+        entries[key] = now + expires, value
+
+
+def digest(form_class, params, prefix=None, scope=None):
+    """Return digest of the parameters that are relevant to
+    ``form_class`` in ``scope``, or ``None`` if a value can not be
+    digested (e.g. a file upload).
+
+        >>> from repoze.formapi.dedupe import digest
+        >>> class TapeForm(Form):
+        ...     fields = {'title': unicode, 'tracks': [int]}
+
+        >>> digest(TapeForm, (('title', 'Rain Dances'),))
+        'formapi:...'
+
+    Values of the same name are ordered; for others, the order does
+    not matter, and neither do names that are not part of the form.
+
+        >>> digest(TapeForm, (('tracks', '1'), ('tracks', '2'))) == \\
+        ...     digest(TapeForm, (('tracks', '2'), ('tracks', '1')))
+        False
+
+        >>> digest(TapeForm, (('title', u'Rain'), ('tracks', '1'))) == \\
+        ...     digest(TapeForm, (('tracks', '1'), ('x', ''), ('title', 'Rain')))
+        True
+
+    Nested input is digested by its end-points.
+
+        >>> digest(TapeForm, {'title': 'Rain', 'tracks': ['1']}) == \\
+        ...     digest(TapeForm, (('title', 'Rain'), ('tracks', '1')))
+        True
+
+    The scope is part of the digest.
+
+        >>> digest(TapeForm, (('title', 'Rain'),), scope=1) == \\
+        ...     digest(TapeForm, (('title', 'Rain'),), scope=2)
+        False
+
+    """
+
+    schema = form_class.schema
+
+    if params is None:
+        params = ()
+    elif isinstance(params, dict):
+        items = []
+        for path, value in walk(params, schema.root):
+            name = '.'.join([unicode(key) for key in path])
+            if isinstance(value, (list, tuple)):
+                items.extend([(name, item) for item in value])
+            else:
+                items.append((name, value))
+        if prefix is not None:
+            for name, value in params.items():
+                if name == prefix or name[:len(prefix) + 1] in (
+                    prefix + '.', prefix + '_', prefix + '-'):
+                    items.append((name, value))
+        params = items
+
+    accept = acceptor(schema, prefix)
+    relevant = []
+    for name, value in params:
+        if isinstance(name, unicode):
+            name = name.encode('utf-8')
+        if not accept(name):
+            continue
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        elif value is None:
+            value = '\x00'
+        elif isinstance(value, (int, long, float)):
+            value = repr(value)
+        elif not isinstance(value, str):
+            return None
+        relevant.append((name, value))
+
+    # the sort is stable; values of the same name keep their order
+    relevant.sort(key=lambda item: item[0])
+
+    if isinstance(scope, unicode):
+        scope = scope.encode('utf-8')
+    else:
+        scope = str(scope)
+
+    h = md5('%s.%s:%s' % (
+        form_class.__module__, form_class.__name__, prefix))
+    h.update('%d:%s' % (len(scope), scope))
+    for name, value in relevant:
+        h.update('%d:%s%d:%s' % (len(name), name, len(value), value))
+    return 'formapi:' + h.hexdigest()
@@ -0,0 +1,198 @@
+import urllib
+
+from repoze.formapi.form import Data
+from repoze.formapi.multipart import FileUpload
+from repoze.formapi.parser import missing
+from repoze.formapi.cache import get_schema
+from repoze.formapi.schema import Node
+
+
+def encode(data, fields):
+    """Yield ``(name, value)`` parameters for ``data``.
+
+    This is the inverse of ``parse``: the fields definition is used to
+    look up values in ``data`` (a dictionary, form data object, proxy
+    or parser) and the values are emitted as dotted parameter names
+    with string values.
+
+        >>> fields = {
+        ...     'title': unicode,
+        ...     'year': int,
+        ...     'playtime': float,
+        ...     'live': bool,
+        ...     'tracks': [unicode],
+        ...     'ratings': {str: {'score': int}},
+        ...     }
+
+        >>> data = {
+        ...     'title': u'Four Wheel Drive',
+        ...     'year': 1975,
+        ...     'playtime': 33.53,
+        ...     'live': False,
+        ...     'tracks': [u'Hey You', u'Lowland Fling'],
+        ...     'ratings': {'allmusic': {'score': 4}},
+        ...     }
+
+        >>> from repoze.formapi.encoder import encode
+        >>> for name, value in encode(data, fields):
+        ...     print name, repr(value)
+        live u''
+        playtime u'33.53'
+        ratings.allmusic.score u'4'
+        title u'Four Wheel Drive'
+        tracks u'Hey You'
+        tracks u'Lowland Fling'
+        year u'1975'
+
+    The parameters round-trip with ``parse``.
+
+        >>> from repoze.formapi import parse
+        >>> parsed, errors = parse(encode(data, fields), fields)
+        >>> parsed['ratings']['allmusic']['score']
+        4
+        >>> parsed['live']
+        False
+        >>> parsed['tracks']
+        [u'Hey You', u'Lowland Fling']
+
+    Values that are missing or ``None`` are not emitted.
+
+        >>> tuple(encode({'title': None}, fields))
+        ()
+
+    A field type may define a ``serialize`` method to control how
+    values are encoded.
+
+        >>> class score(int):
+        ...     @staticmethod
+        ...     def serialize(value):
+        ...         return u'*' * value
+
+        >>> tuple(encode({'ratings': {'allmusic': {'score': 4}}},
+        ...              {'ratings': {str: {'score': score}}}))
+        (('ratings.allmusic.score', u'****'),)
+
+    Input that did not convert is kept in the form data as text; the
+    bundled field types emit it as-is, such that a form can be
+    rendered again with the submitted input.
+
+        >>> from repoze.formapi.converters import isodate, decimal
+        >>> class TripForm(Form):
+        ...     fields = {'date': isodate, 'price': decimal(2)}
+
+        >>> form = TripForm(params=(('date', '1975-13-01'),
+        ...                         ('price', '12.5')))
+        >>> form.errors['date'][0]
+        '...'
+
+        >>> sorted(encode(form.data, TripForm.fields))
+        [('date', '1975-13-01'), ('price', u'12.50')]
+
+    """
+
+    schema = get_schema(fields)
+
+    return iter_node(data, schema.root, '')
+
+
+def urlencode(data, fields, charset='utf-8'):
+    """Return ``data`` as an URL-encoded string.
+
+        >>> from repoze.formapi.encoder import urlencode
+        >>> urlencode({'title': u'Fl\\xfcgel', 'tracks': [1, 2]},
+        ...           {'title': unicode, 'tracks': [int]})
+        'title=Fl%C3%BCgel&tracks=1&tracks=2'
+
+    """
+
+    return '&'.join([
+        '%s=%s' % (quote(name, charset), quote(value, charset))
+        for (name, value) in encode(data, fields)])
+
+
+def iter_node(data, node, prefix):
+    if node.dynamic is not None:
+        child = node.children[node.dynamic]
+        for key in keys(data):
+            value = get(data, key)
+            if value is not missing:
+                if not isinstance(key, basestring):
+                    key = str(key)
+                for item in iter_child(value, child, prefix + key):
+                    yield item
+    else:
+        for key, child in node.static:
+            value = get(data, key)
+            if value is not missing:
+                for item in iter_child(value, child, prefix + key):
+                    yield item
+
+
+def iter_child(value, node, name):
+    if isinstance(node, Node):
+        return iter_node(value, node, name + '.')
+    return iter_field(value, node, name)
+
+
+def iter_field(value, field, name):
+    if field.sequence is not None:
+        if not isinstance(value, (list, tuple)):
+            return
+        values = value
+    else:
+        values = (value,)
+
+    serialize = getattr(field.type, 'serialize', None)
+    for value in values:
+        if value is None or value is missing or \
+               isinstance(value, FileUpload):
+            continue
+        if serialize is not None:
+            value = serialize(value)
+        else:
+            value = format(value)
+        yield name, value
+
+
+def format(value):
+    if isinstance(value, basestring):
+        return value
+    if value is True:
+        return u'1'
+    if value is False:
+        return u''
+    if isinstance(value, float):
+        return unicode(repr(value))
+    return unicode(value)
+
+
+def get(data, key):
+    try:
+        value = data[key]
+    except (KeyError, AttributeError, IndexError, TypeError):
+        return missing
+    if value is None:
+        return missing
+    return value
+
+
+def keys(data):
+    if isinstance(data, Data):
+        # collect the keys of all the data layers
+        result = []
+        seen = set()
+        for layer in data:
+            for key in keys(layer):
+                if key not in seen:
+                    seen.add(key)
+                    result.append(key)
+        return result
+    if hasattr(data, 'keys'):
+        return data.keys()
+    return ()
+
+
+def quote(value, charset):
+    if isinstance(value, unicode):
+        value = value.encode(charset)
+    return urllib.quote_plus(value)
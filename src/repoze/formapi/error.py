@@ -84,6 +84,18 @@ class Errors(object):
       >>> a.get('boo', False)
       False
 
+    The ``flatten`` method returns a list of ``(path, message)`` tuples
+    for all error messages in the tree.
+
+      >>> a += 'Form error'
+      >>> a['foo']['bar'].append('Nested error')
+      >>> for path, message in a.flatten():
+      ...     print path, message
+      () Form error
+      ('bar',) Error
+      ('foo',) Error
+      ('foo', 'bar') Nested error
+
     """
 
     _messages = _dict = None
@@ -136,6 +148,28 @@ class Errors(object):
     def append(self, error):
         self._messages.append(error)
 
+    def clear(self):
+        """Remove all errors."""
+
+        self._dict.clear()
+        del self._messages[:]
+
+    def flatten(self, path=()):
+        result = []
+        self.collect(list(path), result)
+        return result
+
+    def collect(self, path, result):
+        # the path tuple is only created for levels with messages
+        if self._messages:
+            key = tuple(path)
+            for message in self._messages:
+                result.append((key, message))
+        for key, errors in sorted(self._dict.items()):
+            path.append(key)
+            errors.collect(path, result)
+            path.pop()
+
     def get(self, key, default=None):
         assert isinstance(key, basestring), "Key must be a string."
         return self._dict.get(key, default)
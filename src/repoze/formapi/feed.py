@@ -0,0 +1,275 @@
+"""Incremental form input.
+
+A ``Feed`` is fed the request body of a form submission chunk by
+chunk, as it arrives from the network; it does no I/O itself. This
+makes it suitable for servers which deliver the body in messages
+(e.g. ASGI) rather than as a file-like object."""
+
+import cgi
+import sys
+
+from tempfile import SpooledTemporaryFile
+
+from repoze.formapi.error import Errors
+from repoze.formapi.form import submits
+from repoze.formapi.parser import Parser
+from repoze.formapi.parser import apply
+from repoze.formapi.parser import split
+from repoze.formapi.wsgi import Decoder
+from repoze.formapi.wsgi import acceptor
+from repoze.formapi.wsgi import check_size
+from repoze.formapi.wsgi import decode
+from repoze.formapi.wsgi import split_segment
+from repoze.formapi.wsgi import re_separator
+from repoze.formapi.multipart import get_boundary
+from repoze.formapi.multipart import iter_multipart
+from repoze.formapi.multipart import MAX_FIELD_SIZE
+from repoze.formapi.multipart import SPOOL_SIZE
+
+
+class Feed(object):
+    """Incremental input for ``form_class``.
+
+    Parameters of a URL-encoded body are decoded and converted as the
+    chunks arrive; names that are not part of the form are discarded
+    right away. The form is created when the body is complete (see
+    ``close``); other arguments are passed to the form constructor.
+
+        >>> class TapeForm(Form):
+        ...     fields = {'title': unicode, 'year': int}
+        ...     prefix = 'tape'
+        ...
+        ...     @action('save')
+        ...     def save(self, data):
+        ...         return data['title'].upper()
+
+        >>> from repoze.formapi.feed import Feed
+        >>> feed = Feed(TapeForm, query_string='session=abc&year=1975')
+
+        >>> feed.feed('title=Rain+Da')
+        >>> feed.feed('nces&junk=xxxx')
+        >>> feed.feed('&tape.save=')
+
+    Completed parameters have been converted.
+
+        >>> feed.data['year']
+        1975
+
+        >>> form = feed.close()
+        >>> form.data['title'], form.data['year']
+        (u'Rain Dances', 1975)
+
+        >>> form.validate()
+        True
+        >>> form()
+        u'RAIN DANCES'
+
+    Messages of the ASGI HTTP protocol may be passed to ``receive``;
+    it returns true while more body is expected. An ASGI application
+    (on an interpreter with coroutines) reads the body like this::
+
+        feed = from_scope(TapeForm, scope)
+        while feed.receive(await receive()):
+            pass
+        form = feed.close()
+
+        >>> from repoze.formapi.feed import from_scope
+        >>> feed = from_scope(TapeForm, {
+        ...     'type': 'http', 'method': 'POST', 'query_string': '',
+        ...     'headers': [('content-type',
+        ...                  'application/x-www-form-urlencoded')]})
+
+        >>> feed.receive({'type': 'http.request', 'body': 'year=19',
+        ...               'more_body': True})
+        True
+        >>> feed.receive({'type': 'http.request', 'body': '76&tape.save='})
+        False
+
+        >>> form = feed.close()
+        >>> form.data['year'], form.action
+        (1976, <Action name="save" submitted="True">)
+
+    Conversion errors are reported by the form.
+
+        >>> feed = Feed(TapeForm)
+        >>> feed.feed('year=late&tape.save')
+        >>> feed.close().errors['year'][0]
+        "invalid literal for int() with base 10: 'late'"
+
+    Multipart bodies are spooled (to a temporary file, if large) and
+    parsed when the body is complete; bodies of other content types
+    are ignored. Parameters are converted by the form if it's lazy, has
+    a policy for repeated values or is restricted to a subset of
+    fields.
+    """
+
+    def __init__(self, form_class, content_type=None, query_string=None,
+                 prefix=None, charset='utf-8', max_size=None,
+                 max_field_size=MAX_FIELD_SIZE, **kwargs):
+        if prefix is None:
+            prefix = form_class.prefix
+
+        schema = form_class.schema
+        self.form_class = form_class
+        self.schema = schema
+        self.prefix = prefix
+        self.charset = charset
+        self.max_size = max_size
+        self.max_field_size = max_field_size
+        self.kwargs = kwargs
+        self.accept = acceptor(schema, prefix)
+        self.size = 0
+        self.count = 0
+
+        # action parameters are passed to the form (if input is
+        # converted by the feed)
+        self.actions = []
+
+        if form_class.lazy or form_class.repeated is not None or \
+               kwargs.get('only') is not None:
+            self.params = []
+            self.data = self.errors = None
+        else:
+            self.params = None
+            self.data = Parser(schema.fields)
+            self.data.buffer()
+            self.errors = Errors()
+
+        self.decoder = None
+        self.spool = None
+        self.boundary = None
+        self.failure = None
+
+        content_type, options = cgi.parse_header(content_type or '')
+        content_type = content_type.lower()
+        if content_type in ('', 'application/x-www-form-urlencoded'):
+            self.decoder = Decoder(self.accept)
+        elif content_type == 'multipart/form-data':
+            self.boundary = get_boundary(options)
+            self.spool = SpooledTemporaryFile(SPOOL_SIZE)
+
+        if query_string:
+            pairs = []
+            for segment in re_separator.split(query_string):
+                pair = split_segment(segment, self.accept)
+                if pair is not None:
+                    pairs.append(pair)
+            self.add(pairs)
+
+    def feed(self, chunk):
+        """Process a chunk of the request body."""
+
+        self.size += len(chunk)
+        check_size(self.size, self.max_size)
+
+        if self.decoder is not None:
+            pairs = self.decoder.feed(chunk)
+            if pairs:
+                self.add(pairs)
+        elif self.spool is not None:
+            self.spool.write(chunk)
+
+    def receive(self, message):
+        """Process an ASGI message; returns true if more body is
+        expected."""
+
+        kind = message.get('type')
+        if kind == 'http.disconnect':
+            raise IOError("Client disconnected.")
+        if kind != 'http.request':
+            raise ValueError("Unexpected message: %r." % kind)
+
+        body = message.get('body')
+        if body:
+            self.feed(body)
+        return bool(message.get('more_body', False))
+
+    def add(self, pairs):
+        """Add parameters; their values are decoded and converted."""
+
+        charset = self.charset
+        pairs = [(name, decode(value, charset)) for (name, value) in pairs]
+
+        prefix = self.prefix
+        if prefix is not None:
+            length = len(prefix)
+            for pair in pairs:
+                name = pair[0]
+                if name.startswith(prefix) and (
+                    len(name) == length or name[length] in '._-'):
+                    self.actions.append(pair)
+
+        self.count += len(pairs)
+        if self.params is not None:
+            self.params.extend(pairs)
+        elif self.failure is None:
+            # the form ignores the input unless an action is
+            # submitted; until then, a failure is not raised
+            try:
+                apply(split(pairs), self.data, self.errors)
+            except:
+                self.failure = sys.exc_info()
+
+    def close(self):
+        """Return the form for the input."""
+
+        if self.decoder is not None:
+            self.add(self.decoder.close())
+            self.decoder = None
+
+        spool = self.spool
+        if spool is not None:
+            self.spool = None
+            spool.seek(0)
+            try:
+                self.add(iter_multipart(
+                    spool.read, self.boundary, self.size, self.accept,
+                    self.schema, charset=self.charset,
+                    max_field_size=self.max_field_size))
+            finally:
+                spool.close()
+
+        if self.params is not None:
+            params = self.params
+        else:
+            params = self.actions
+
+        form = self.form_class(
+            params=params, prefix=self.prefix, **self.kwargs)
+
+        data = self.data
+        action_params = {}
+        for name, value in self.actions:
+            if name == self.prefix:
+                action_params[None] = value
+
+        if data is not None and self.count and submits(
+            form.prefix, form.actions, action_params):
+            failure = self.failure
+            if failure is not None:
+                raise failure[0], failure[1], failure[2]
+
+            # the form has parsed the action parameters, which
+            # are included in the data
+            data.finalize()
+            form.data.update(data)
+            form.errors = self.errors
+
+        return form
+
+
+def from_scope(form_class, scope, **kwargs):
+    """Return a ``Feed`` for the request described by an ASGI HTTP
+    connection ``scope``; other arguments are passed to the feed."""
+
+    content_type = None
+    for name, value in scope.get('headers', ()):
+        if name.lower() == 'content-type':
+            content_type = value
+
+    if scope.get('method', 'GET') not in ('POST', 'PUT'):
+        # the body is ignored
+        content_type = 'application/octet-stream'
+
+    return Feed(
+        form_class, content_type, scope.get('query_string'), **kwargs)
@@ -1,5 +1,17 @@
 from repoze.formapi.parser import parse
 from repoze.formapi.parser import missing
+from repoze.formapi.parser import Parser
+from repoze.formapi.record import build
+from repoze.formapi.record import get_record
+from repoze.formapi.state import restore
+from repoze.formapi.pool import Pool
+from repoze.formapi.error import Errors
+from repoze.formapi.wsgi import parse_environ
+from repoze.formapi.py24 import json
+from repoze.formapi import cache
+from repoze.formapi.schema import freeze
+from repoze.formapi import instrument
+from repoze.formapi.instrument import timer
 
 import types
 import re
@@ -25,7 +37,7 @@ class Validator(object):
         if not fields:
             self.fieldpaths = ((),)
         else:
-            self.fieldpaths = [f.split('.') for f in fields]
+            self.fieldpaths = tuple([tuple(f.split('.')) for f in fields])
 
     def __call__(self, form):
         for error in self.func(form):
@@ -50,13 +62,71 @@ class Action(object):
             type(self).__name__, self.name or "", str(bool(self.submitted)))
 
 class metaclass(type):
+    """Prepares form classes.
+
+    The fields definition is frozen (made read-only) and compiled when
+    the class is created; validators and actions are collected. The
+    class is not changed after this; all state that relates to a
+    request is kept on the form instance. This makes form classes safe
+    to share between threads."""
+
     def __init__(kls, name, bases, dict):
         kls.validators = tuple(get_instances_of(Validator, kls))
         kls.actions = tuple(get_instances_of(Action, kls))
+        if 'fields' in dict:
+            kls.fields = dict['fields']
+
+    def __setattr__(kls, name, value):
+        if name == 'fields':
+            value = freeze(value)
+            type.__setattr__(kls, '_schema', cache.get_schema(value))
+            type.__setattr__(kls, '_compiled', value)
+        type.__setattr__(kls, name, value)
+
+    def get_schema(kls):
+        """Return the compiled ``fields`` definition of the form
+        class. Form classes with equal fields definitions share the
+        compiled schema (see ``cache``)."""
+
+        schema = kls.__dict__.get('_schema')
+        if schema is None or kls.__dict__.get('_compiled') is not kls.fields:
+            schema = cache.get_schema(kls.fields)
+            type.__setattr__(kls, '_schema', schema)
+            type.__setattr__(kls, '_compiled', kls.fields)
+        return schema
+
+    def set_schema(kls, schema):
+        if schema.fields != kls.fields:
+            raise ValueError("Schema does not match fields definition.")
+        type.__setattr__(kls, '_schema', schema)
+        type.__setattr__(kls, '_compiled', kls.fields)
+
+    schema = property(get_schema, set_schema)
+
+    def get_pool(kls):
+        """Return the pool of reusable instances of the form class
+        (see ``Pool``)."""
+
+        pool = kls.__dict__.get('_pool')
+        if pool is None:
+            pool = Pool(kls)
+            type.__setattr__(kls, '_pool', pool)
+        return pool
+
+    pool = property(get_pool)
 
 class Form(object):
     """Base form class. Optionally pass a dictionary as ``data`` and a
-    WebOb-like request object as ``request``."""
+    WebOb-like request object as ``request``, or a WSGI environment
+    as ``environ``. To restrict the form to a subset of fields, pass
+    their dotted paths as ``only``. To restore the parsed state of a
+    previous request, pass ``state`` (see the ``state`` module); the
+    input is merged into it.
+
+    If ``lazy`` is set, input values are converted when first read;
+    the ``errors`` attribute and ``validate`` convert all values. Set
+    ``repeated`` to ``'first'`` or ``'last'`` to keep only one value
+    of fields that are submitted more than once (see ``parse``)."""
 
     __metaclass__ = metaclass
 
@@ -64,11 +134,45 @@ class Form(object):
     status = None
     prefix = None
     action = None
-
-    def __init__(self, data=None, context=None, request=None, params=None, prefix=None):
+    lazy = False
+    repeated = None
+
+    _parsed = None
+    _errors = None
+    _validation_errors = None
+
+    def __init__(self, data=None, context=None, request=None, params=None,
+                 prefix=None, environ=None, only=None, state=None):
+        self.reset(data, context, request, params, prefix, environ, only,
+                   state)
+
+    def reset(self, data=None, context=None, request=None, params=None,
+              prefix=None, environ=None, only=None, state=None):
+        """Reset the form for new input; the arguments are those of
+        the constructor. The data object, actions, parser and error
+        tree of the form are reused (and cleared); references to them
+        must not be kept across a reset."""
+
+        self.clear()
         self.context = context
         self.request = request
 
+        attributes = self.__dict__
+        errors = self._errors
+
+        if only is not None:
+            # restrict the form to a subset of fields
+            only = tuple([tuple(path.split('.')) for path in only])
+            self.validators = tuple([
+                validator for validator in type(self).validators
+                if overlaps(validator.fieldpaths, only)])
+        self.only = only
+
+        observer = instrument.observer
+        if observer is not None:
+            observer = observer.start(self)
+        self.observer = observer
+
         if context is not None:
             if data is not None:
                 raise ValueError(
@@ -77,10 +181,14 @@ class Form(object):
             # proxy the context object
             data = Proxy(context)
 
-        self.data = Data(data)
+        form_data = attributes.get('data')
+        if form_data is None:
+            self.data = Data(data)
+        else:
+            form_data.reset(data)
 
         if prefix is None:
-            prefix = self.prefix
+            prefix = type(self).prefix
 
         if request is not None:
             if params is not None:
@@ -88,67 +196,193 @@ class Form(object):
                     "Can't provide both ``params`` and ``request``.")
             params = request.params.items()
 
-        # find action parameters
-        action_params = {}
-        if prefix is not None and params is not None:
-            re_prefix = re.compile(r'^%s[._-](?P<name>.*)' % prefix)
-            for key, value in params:
-                if key == prefix:
-                    action_params[None] = value
-                else:
-                    m = re_prefix.search(key)
-                    if m is not None:
-                        action_params[m.group('name')] = value
+        if environ is not None:
+            if params is not None:
+                raise ValueError(
+                    "Can't provide both ``params`` and ``environ``.")
+            params = parse_environ(environ, type(self).schema, prefix)
+
+        if hasattr(params, 'read'):
+            params = json.load(params)
+        elif params is not None and not isinstance(params, dict):
+            # the parameters are iterated more than once (and may be
+            # an iterator)
+            params = list(params)
+
+        if observer is not None:
+            if params is not None:
+                observer.params(params, prefix)
+            started = timer()
+
+        action_params = find_action_params(params, prefix)
 
         # initialize form actions
-        actions = self.actions = []
-        for action in type(self).actions:
-            name = action.name
-            action = Action(action.__call__, name, name in action_params)
-            actions.append(action)
+        actions = attributes.get('actions')
+        if actions is None:
+            actions = self.actions = [
+                Action(action.__call__, action.name)
+                for action in type(self).actions]
+        for action in actions:
+            action.submitted = action.name in action_params
             if action:
                 self.action = action
 
-        # conditionally apply request parameters if:
-        # 1. no prefix has been set
-        # 2. there is a submitted action
-        # 3. there are no defined actions, but a default action was submitted
-        if params is not None and (
-            prefix is None or \
-            filter(None, actions) or \
-            len(actions) == 0 and action_params.get(None) is not None):
-            params = list(params)
+        if params is not None and submits(prefix, actions, action_params):
+            if only is not None:
+                params = select(params, only)
         else:
             params = ()
 
-        # Parse parameter input
-        data, errors = parse(params, self.fields)
+        if observer is not None:
+            observer.phase('actions', timer() - started)
+            started = timer()
+
+        # Parse parameter input; render-only forms (no input) skip the
+        # parser and the error tree is created on demand
+        if len(params) or state is not None:
+            if isinstance(params, dict) or state is not None:
+                fields = type(self).schema
+            else:
+                fields = self.fields
+
+            if state is None:
+                # the parser of a previous use is reused
+                data, errors = parse(
+                    params, fields, observer, self.lazy, self.repeated,
+                    attributes.get('_parser'), errors)
+                if not self.lazy:
+                    self._parser = data
+            else:
+                data, errors = restore(
+                    state, params, fields, observer, self.lazy,
+                    self.repeated)
+
+            if observer is not None:
+                observer.phase('parse', timer() - started)
+
+            if self.lazy:
+                self._parsed = data
 
-        if len(params):
             self.data.update(data)
+            self._errors = errors
 
-        self.errors = errors
         self.prefix = prefix
 
+    def clear(self):
+        """Clear the state of the previous use, such that the form
+        does not keep references to its input (see ``Pool``); unlike
+        ``reset``, no observer is started."""
+
+        attributes = self.__dict__
+        for name in ('validators', 'status', 'action', '_parsed',
+                     '_validation_errors'):
+            attributes.pop(name, None)
+        self.context = self.request = self.observer = None
+
+        errors = self._errors
+        if errors is not None:
+            errors.clear()
+
+        # the parser is kept for reuse, but not its values
+        parser = attributes.get('_parser')
+        if parser is not None:
+            parser.clear()
+
+        data = attributes.get('data')
+        if data is not None:
+            data.reset()
+
+        actions = attributes.get('actions')
+        if actions is not None:
+            for action in actions:
+                action.submitted = False
+
+    def get_errors(self):
+        parsed = self._parsed
+        if parsed is not None:
+            parsed.materialize()
+        errors = self._errors
+        if errors is None:
+            errors = self._errors = Errors()
+        return errors
+
+    def set_errors(self, errors):
+        self._errors = errors
+
+    errors = property(get_errors, set_errors, doc=(
+        """Errors of the form (conversion and validation). Pending
+        values are converted if the form is lazy."""))
+
+    def record(self):
+        """Return the parsed input as a record (see ``record``); the
+        values of the data object (or context) are not included."""
+
+        parser = None
+        for layer in self.data:
+            if isinstance(layer, Parser):
+                parser = layer
+        if parser is None:
+            return get_record(type(self).schema)()
+        return build(parser)
+
     def __call__(self):
         """Calls the first submitted action and returns the value."""
 
         if self.action is not None:
-            self.status = self.action(self, self.data)
+            observer = self.observer
+            if observer is None:
+                self.status = self.action(self, self.data)
+            else:
+                started = timer()
+                self.status = self.action(self, self.data)
+                observer.phase('call', timer() - started)
         return self.status
 
     def validate(self):
         """Validates the request against the form fields. Returns
         ``True`` if all fields validate, else ``False``."""
+
+        observer = self.observer
+        if observer is not None:
+            return self.observe_validate(observer)
+
+        for validator in self.validators:
+            for field_path, validation_error in validator(self):
+                self.add_validation_error(field_path, validation_error)
+
+        return not bool(self.errors)
+
+    def observe_validate(self, observer):
+        """Validates the form, reporting events to ``observer``."""
+
+        validation_started = timer()
         for validator in self.validators:
+            started = timer()
+            count = 0
             for field_path, validation_error in validator(self):
-                errors = self.errors
-                for field in field_path:
-                    errors = errors[field]
-                errors += validation_error
+                self.add_validation_error(field_path, validation_error)
+                count += 1
+            observer.validate(validator, timer() - started, count)
 
+        observer.phase('validate', timer() - validation_started)
         return not bool(self.errors)
 
+    def add_validation_error(self, field_path, message):
+        """Add a validation error ``message`` for the field at
+        ``field_path`` (a tuple of keys)."""
+
+        errors = self.errors
+        for field in field_path:
+            errors = errors[field]
+        errors += message
+
+        # the errors of validators are kept apart from those of the
+        # input (see ``state.dump``)
+        validation_errors = self._validation_errors
+        if validation_errors is None:
+            validation_errors = self._validation_errors = []
+        validation_errors.append((tuple(field_path), message))
+
 class ValidationError(Exception):
     """Represents a field validation error."""
 
@@ -168,6 +402,84 @@ class ValidationError(Exception):
     def __unicode__(self):
         return self.msg
 
+def find_action_params(params, prefix):
+    """Return the submitted action parameters by action name (the
+    default action is ``None``)."""
+
+    action_params = {}
+    if prefix is not None and params is not None:
+        re_prefix = re.compile(r'^%s[._-](?P<name>.*)' % prefix)
+        items = params
+        if isinstance(params, dict):
+            items = params.items()
+        for key, value in items:
+            if key == prefix:
+                action_params[None] = value
+            else:
+                m = re_prefix.search(key)
+                if m is not None:
+                    action_params[m.group('name')] = value
+    return action_params
+
+def submits(prefix, actions, action_params):
+    """Return true if request parameters apply to a form with
+    ``prefix`` and ``actions``, given the submitted ``action_params``
+    (by action name; the default action is ``None``)."""
+
+    # conditionally apply request parameters if:
+    # 1. no prefix has been set
+    # 2. there is a submitted action
+    # 3. there are no defined actions, but a default action was submitted
+    return prefix is None or \
+           bool(filter(None, actions)) or \
+           len(actions) == 0 and action_params.get(None) is not None
+
+def matches(a, b):
+    """Return true if the path ``a`` is a prefix of ``b`` or vice versa;
+    an asterisk matches any key."""
+
+    for x, y in zip(a, b):
+        if x != y and x != '*' and y != '*':
+            return False
+    return True
+
+def overlaps(fieldpaths, only):
+    for path in fieldpaths:
+        # form-level validators are not restricted to any field
+        if path:
+            for selected in only:
+                if matches(path, selected):
+                    return True
+    return False
+
+def select(params, only, path=()):
+    """Return the parameters that fall within one of the ``only``
+    paths."""
+
+    if isinstance(params, dict):
+        result = {}
+        for key, value in params.items():
+            name = path + (key,)
+            for selected in only:
+                if matches(name, selected):
+                    if len(name) < len(selected):
+                        if not isinstance(value, dict):
+                            continue
+                        value = select(value, only, name)
+                    result[key] = value
+                    break
+        return result
+
+    result = []
+    for name, value in params:
+        name_path = tuple(name.split('.'))
+        for selected in only:
+            if len(name_path) >= len(selected) and \
+                   matches(name_path, selected):
+                result.append((name, value))
+                break
+    return result
+
 class Data(list):
     """Form data object with dictionary-like interface. If initialized
     with a ``data`` object, this will be used to provide default
@@ -200,6 +512,16 @@ class Data(list):
     def head(self):
         return list.__getitem__(self, 0)
 
+    def reset(self, data=None):
+        """Remove all layers; ``data`` provides the default values."""
+
+        tail = self.tail
+        tail.clear()
+        del self[:]
+        if data is not None:
+            self.append(data)
+        self.append(tail)
+
     def update(self, data):
         """Updates the dictionary by appending ``data`` to the list at
         the position just before the current dictionary."""
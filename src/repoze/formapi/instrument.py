@@ -0,0 +1,382 @@
+import heapq
+import random
+import threading
+import time
+
+from timeit import default_timer as timer
+from repoze.formapi.py24 import deque
+
+# the installed observer; ``None`` when instrumentation is disabled
+observer = None
+
+
+def install(new):
+    """Install an observer for all forms (replacing any existing
+    observer)."""
+
+    global observer
+    observer = new
+
+
+def uninstall():
+    """Disable instrumentation."""
+
+    global observer
+    observer = None
+
+
+class Observer(object):
+    """Base class for observers.
+
+    When instrumentation is enabled (see ``install``), the ``start``
+    method is called for each form that is constructed; the returned
+    object receives the events for that form instance. Return ``None``
+    to skip instrumentation of the form.
+
+    The events are:
+
+    - ``params(params, prefix)`` with the input parameters of the form
+      (a sequence of ``(name, value)`` tuples or a dictionary), before
+      they are parsed.
+
+    - ``phase(name, duration)`` for each of the form phases: ``actions``
+      (action detection), ``parse`` (parameter conversion), ``validate``
+      and ``call`` (the submitted action).
+
+    - ``convert(path, value, duration, error)`` for each converted
+      parameter; ``path`` is the field path tuple, ``value`` the input
+      and ``error`` is true if the conversion failed.
+
+    - ``validate(validator, duration, errors)`` for each validator;
+      ``errors`` is the number of errors reported by the validator.
+
+    Durations are in seconds. This base class ignores all events.
+    """
+
+    def start(self, form):
+        return self
+
+    def params(self, params, prefix):
+        pass
+
+    def phase(self, name, duration):
+        pass
+
+    def convert(self, path, value, duration, error):
+        pass
+
+    def validate(self, validator, duration, errors):
+        pass
+
+
+class Aggregator(Observer):
+    """In-process aggregation of timings and counts.
+
+        >>> from repoze.formapi import instrument
+        >>> aggregator = instrument.Aggregator()
+        >>> instrument.install(aggregator)
+
+        >>> class TapeForm(Form):
+        ...     fields = {
+        ...         'title': unicode,
+        ...         'tracks': {str: {'length': int}}}
+        ...
+        ...     @validator('title')
+        ...     def check_title(self):
+        ...         if not self.data['title']:
+        ...             yield "Required"
+
+        >>> form = TapeForm(params=(
+        ...     ('title', ''),
+        ...     ('tracks.a1.length', '190'),
+        ...     ('tracks.a2.length', 'long')))
+        >>> form.validate()
+        False
+
+        >>> instrument.uninstall()
+
+    Conversions are aggregated per field; dynamic keys are collapsed.
+
+        >>> for key, count, total, worst in aggregator.items():
+        ...     print key, count
+        TapeForm actions 1
+        TapeForm convert title 1
+        TapeForm convert tracks.*.length 2
+        TapeForm convert-error tracks.*.length 1
+        TapeForm parse 1
+        TapeForm validate 1
+        TapeForm validator check_title 1
+        TapeForm validator-error check_title 1
+
+    Statistics are dumped as text, ordered by total time.
+
+        >>> print aggregator.dump()
+        count     total ms    max ms  event
+            1  ...  TapeForm ...
+        ...
+
+    The aggregator can be reset.
+
+        >>> aggregator.reset()
+        >>> aggregator.items()
+        []
+
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def start(self, form):
+        return Recorder(self, type(form))
+
+    def add(self, key, duration):
+        self.lock.acquire()
+        try:
+            stats = self.stats.get(key)
+            if stats is None:
+                self.stats[key] = [1, duration, duration]
+            else:
+                stats[0] += 1
+                stats[1] += duration
+                if duration > stats[2]:
+                    stats[2] = duration
+        finally:
+            self.lock.release()
+
+    def items(self):
+        """Return sorted list of ``(key, count, total, max)`` tuples,
+        e.g. to feed a metrics client. The key is a string that
+        identifies the form class and event."""
+
+        self.lock.acquire()
+        try:
+            items = [
+                (key, count, total, worst)
+                for (key, (count, total, worst)) in self.stats.items()]
+        finally:
+            self.lock.release()
+
+        items.sort()
+        return items
+
+    def dump(self):
+        """Return statistics as text, ordered by total time."""
+
+        items = self.items()
+        items.sort(key=lambda item: -item[2])
+        lines = ["%5s %12s %9s  %s" % (
+            "count", "total ms", "max ms", "event")]
+        for key, count, total, worst in items:
+            lines.append("%5d %12.3f %9.3f  %s" % (
+                count, total * 1000, worst * 1000, key))
+        return "\n".join(lines)
+
+    def reset(self):
+        self.lock.acquire()
+        try:
+            self.stats.clear()
+        finally:
+            self.lock.release()
+
+
+class Recorder(Observer):
+    """Records the events of a single form in an aggregator."""
+
+    def __init__(self, aggregator, form_class):
+        self.aggregator = aggregator
+        self.form_class = form_class
+        self.name = form_class.__name__
+
+    def phase(self, name, duration):
+        self.aggregator.add("%s %s" % (self.name, name), duration)
+
+    def convert(self, path, value, duration, error):
+        name = field_name(self.form_class, path)
+        self.aggregator.add("%s convert %s" % (self.name, name), duration)
+        if error:
+            self.aggregator.add(
+                "%s convert-error %s" % (self.name, name), duration)
+
+    def validate(self, validator, duration, errors):
+        name = validator_name(validator)
+        self.aggregator.add("%s validator %s" % (self.name, name), duration)
+        if errors:
+            self.aggregator.add(
+                "%s validator-error %s" % (self.name, name), duration)
+
+
+class Sampler(Observer):
+    """Sampling profiler for conversions and validators.
+
+    A fraction ``rate`` of the forms is sampled; for each sample, the
+    ``slowest`` conversions and validator calls are recorded. The
+    samples are kept in a ring buffer of ``size`` entries.
+
+        >>> from repoze.formapi import instrument
+        >>> sampler = instrument.Sampler(rate=1.0, slowest=2, size=10)
+        >>> instrument.install(sampler)
+
+        >>> class TapeForm(Form):
+        ...     fields = {
+        ...         'title': unicode,
+        ...         'tracks': {str: {'length': int}}}
+        ...
+        ...     @validator('title')
+        ...     def check_title(self):
+        ...         if not self.data['title']:
+        ...             yield "Required"
+
+        >>> form = TapeForm(params=(
+        ...     ('title', ''),
+        ...     ('tracks.a1.length', '190'),
+        ...     ('tracks.a2.length', '220')))
+        >>> form.validate()
+        False
+
+        >>> instrument.uninstall()
+
+    Each sample records the form class and the slowest events (of
+    which there are at most two in this example).
+
+        >>> sample, = sampler.samples()
+        >>> sample.form_class is TapeForm
+        True
+
+        >>> entries = sample.entries()
+        >>> len(entries)
+        2
+
+    An entry gives the duration (in seconds), kind, field path and the
+    size of the input.
+
+        >>> entry = entries[0]
+        >>> sorted(entry)
+        ['duration', 'form', 'kind', 'path', 'size']
+
+    The ``dump`` method renders the slowest entries of all samples as
+    text (e.g. for a debug view).
+
+        >>> print sampler.dump()
+        duration ms  kind       form      path (size)
+        ...  TapeForm  ...
+
+    Forms that are not sampled are not instrumented at all.
+
+        >>> sampler.rate = 0.0
+        >>> sampler.start(form) is None
+        True
+
+    """
+
+    def __init__(self, rate=0.01, slowest=10, size=100):
+        self.rate = rate
+        self.slowest = slowest
+        self.buffer = deque(maxlen=size)
+
+    def start(self, form):
+        if random.random() >= self.rate:
+            return None
+        sample = Sample(type(form), self.slowest)
+        self.buffer.append(sample)
+        return sample
+
+    def samples(self):
+        """Return list of samples, oldest first."""
+
+        return list(self.buffer)
+
+    def entries(self, count=None):
+        """Return the slowest entries of all samples."""
+
+        entries = []
+        for sample in self.samples():
+            entries.extend(sample.entries())
+        entries.sort(key=lambda entry: -entry['duration'])
+        return entries[:count]
+
+    def dump(self, count=20):
+        """Return the slowest entries as text."""
+
+        lines = ["%11s  %-10s %-9s %s" % (
+            "duration ms", "kind", "form", "path (size)")]
+        for entry in self.entries(count):
+            size = entry['size']
+            if size is None:
+                size = ''
+            else:
+                size = ' (%d)' % size
+            lines.append("%11.3f  %-10s %-9s %s%s" % (
+                entry['duration'] * 1000, entry['kind'], entry['form'],
+                entry['path'], size))
+        return "\n".join(lines)
+
+
+class Sample(Observer):
+    """Records the slowest events of a sampled form."""
+
+    def __init__(self, form_class, slowest):
+        self.form_class = form_class
+        self.slowest = slowest
+        self.time = time.time()
+        self.heap = []
+
+    def entries(self):
+        """Return the recorded entries, slowest first."""
+
+        return [entry for (duration, count, entry) in
+                sorted(self.heap, reverse=True)]
+
+    def add(self, duration, kind, path, size):
+        heap = self.heap
+        if len(heap) >= self.slowest:
+            if duration <= heap[0][0]:
+                return
+            push = heapq.heapreplace
+        else:
+            push = heapq.heappush
+
+        entry = {
+            'duration': duration,
+            'kind': kind,
+            'form': self.form_class.__name__,
+            'path': path,
+            'size': size,
+            }
+
+        # the counter breaks ties between equal durations
+        push(heap, (duration, len(heap), entry))
+
+    def convert(self, path, value, duration, error):
+        try:
+            size = len(value)
+        except TypeError:
+            size = None
+        kind = 'convert'
+        if error:
+            kind = 'convert!'
+        self.add(duration, kind, field_name(self.form_class, path), size)
+
+    def validate(self, validator, duration, errors):
+        name = validator_name(validator)
+        paths = getattr(validator, 'fieldpaths', ())
+        fields = ', '.join(['.'.join(path) for path in paths if path])
+        if fields:
+            name = '%s (%s)' % (name, fields)
+        self.add(duration, 'validator', name, None)
+
+
+def field_name(form_class, path):
+    """Return dotted name of the field for ``path``; dynamic keys are
+    shown as an asterisk."""
+
+    try:
+        node = form_class.schema.traverse(path)
+    except (KeyError, TypeError):
+        return '.'.join(map(str, path))
+    return node.name
+
+
+def validator_name(validator):
+    func = getattr(validator, 'func', validator)
+    return getattr(func, '__name__', repr(func))
@@ -0,0 +1,323 @@
+import cgi
+
+from tempfile import SpooledTemporaryFile
+
+BUFSIZE = 64 * 1024
+SPOOL_SIZE = 64 * 1024
+MAX_HEADER_SIZE = 16 * 1024
+
+# the default size limit of parts that are not file uploads
+MAX_FIELD_SIZE = 1024 * 1024
+
+
+class FileUpload(object):
+    """File uploaded as part of a ``multipart/form-data`` request.
+
+    The uploaded data is available as a file-like object in the
+    ``file`` attribute; the ``read`` and ``seek`` methods are provided
+    for convenience.
+
+        >>> from StringIO import StringIO
+        >>> from repoze.formapi.multipart import FileUpload
+        >>> upload = FileUpload('photo', StringIO('...'), 'tape.jpg',
+        ...                     'image/jpeg', 3)
+
+        >>> upload
+        <FileUpload photo="tape.jpg" (3 bytes)>
+
+        >>> upload.read()
+        '...'
+
+    """
+
+    max_size = None
+
+    def __init__(self, name, file, filename, type=None, size=0):
+        self.name = name
+        self.file = file
+        self.filename = filename
+        self.type = type
+        self.size = size
+
+    def __repr__(self):
+        return '<%s %s="%s" (%d bytes)>' % (
+            type(self).__name__, self.name, self.filename, self.size)
+
+    def read(self, *args):
+        return self.file.read(*args)
+
+    def seek(self, *args):
+        return self.file.seek(*args)
+
+    def close(self):
+        self.file.close()
+
+
+class LimitExceeded(ValueError):
+    """Raised when a request exceeds a size limit."""
+
+
+class MultipartError(ValueError):
+    """Raised when a multipart request body is malformed."""
+
+
+def upload(max_size=None):
+    """Return a field type for file uploads.
+
+    The optional ``max_size`` argument limits the size (in bytes) of
+    the uploaded file; the request is aborted as soon as the limit is
+    exceeded.
+
+        >>> from repoze.formapi.multipart import upload
+        >>> photo = upload(max_size=1024)
+        >>> photo.max_size
+        1024
+
+    The field type accepts only file uploads.
+
+        >>> photo('tape.jpg')
+        Traceback (most recent call last):
+         ...
+        ValueError: Not a file upload.
+
+    """
+
+    class upload(FileUpload):
+        def __new__(cls, value):
+            if isinstance(value, FileUpload):
+                return value
+            raise ValueError("Not a file upload.")
+
+    upload.max_size = max_size
+    return upload
+
+
+def iter_multipart(read, boundary, length, accept, schema,
+                   charset='utf-8', max_field_size=MAX_FIELD_SIZE,
+                   spool_size=SPOOL_SIZE, bufsize=BUFSIZE):
+    """Yield ``(name, value)`` pairs from a ``multipart/form-data``
+    stream of ``length`` bytes.
+
+    Parts are streamed; the content of a part is only kept if the name
+    is accepted. File parts for upload fields are written to a spooled
+    temporary file and yielded as a ``FileUpload`` object; other parts
+    are yielded as strings, limited in size by ``max_field_size`` (by
+    default, 1 MB; pass ``None`` for no limit).
+
+        >>> from StringIO import StringIO
+        >>> from repoze.formapi.schema import Schema
+        >>> from repoze.formapi.multipart import upload, iter_multipart
+
+        >>> schema = Schema({'title': str, 'cover': upload(max_size=16)})
+        >>> body = '\\r\\n'.join((
+        ...     '--xyz',
+        ...     'Content-Disposition: form-data; name="title"',
+        ...     '',
+        ...     'Four Wheel Drive',
+        ...     '--xyz',
+        ...     'Content-Disposition: form-data; name="junk"',
+        ...     '',
+        ...     'x' * 100,
+        ...     '--xyz',
+        ...     'Content-Disposition: form-data; name="cover"; '
+        ...     'filename="cover.jpg"',
+        ...     'Content-Type: image/jpeg',
+        ...     '',
+        ...     '0123456789',
+        ...     '--xyz--',
+        ...     ''))
+
+        >>> def parse(body, **kwargs):
+        ...     return list(iter_multipart(
+        ...         StringIO(body).read, 'xyz', len(body),
+        ...         schema.__contains__, schema, bufsize=5, **kwargs))
+
+        >>> params = parse(body)
+        >>> params
+        [('title', 'Four Wheel Drive'),
+         ('cover', <FileUpload cover="cover.jpg" (10 bytes)>)]
+
+        >>> cover = params[1][1]
+        >>> cover.type
+        'image/jpeg'
+        >>> cover.read()
+        '0123456789'
+
+    Limits abort the request as soon as they are exceeded.
+
+        >>> parse(body.replace('0123456789', '0123456789' * 2))
+        Traceback (most recent call last):
+         ...
+        LimitExceeded: Upload exceeds size limit for 'cover' (16 bytes).
+
+        >>> parse(body, max_field_size=8)
+        Traceback (most recent call last):
+         ...
+        LimitExceeded: Field exceeds size limit for 'title' (8 bytes).
+
+    An empty file input is submitted as an empty string.
+
+        >>> parse(body.replace('0123456789', '').replace('cover.jpg', ''))
+        [('title', 'Four Wheel Drive'), ('cover', '')]
+
+    A body that is malformed raises a ``MultipartError``.
+
+        >>> parse(body[:-10])
+        Traceback (most recent call last):
+         ...
+        MultipartError: Unexpected end of multipart body.
+
+    """
+
+    stream = Stream(read, length, bufsize)
+    delimiter = '--' + boundary
+    separator = '\r\n' + delimiter
+
+    # skip the preamble
+    buffer = ''
+    while delimiter not in buffer:
+        if stream.eof:
+            return
+        buffer = buffer[-len(delimiter):] + stream.read()
+    buffer = buffer[buffer.index(delimiter) + len(delimiter):]
+
+    while True:
+        # read the line that ends the delimiter and the part headers
+        while '\r\n\r\n' not in buffer:
+            if buffer[:2] == '--' or stream.eof:
+                return
+            if len(buffer) > MAX_HEADER_SIZE:
+                raise LimitExceeded("Part headers exceed size limit.")
+            buffer += stream.read()
+
+        if buffer[:2] == '--':
+            return
+
+        head, buffer = buffer.split('\r\n\r\n', 1)
+        headers = {}
+        for line in head.split('\r\n'):
+            key, sep, value = line.partition(':')
+            headers[key.strip().lower()] = value.strip()
+
+        disposition, options = cgi.parse_header(
+            headers.get('content-disposition', ''))
+
+        name = options.get('name')
+        filename = options.get('filename')
+
+        # determine how to store the part content; parts that are not
+        # accepted are read and discarded
+        store = None
+        limit = max_field_size
+        field_type = None
+
+        if name is not None:
+            if accept(name):
+                store = []
+                if filename is not None:
+                    field_type = upload_type(schema, name)
+                    if field_type is not None:
+                        store = SpooledTemporaryFile(spool_size)
+                        limit = field_type.max_size
+
+        size = 0
+        while True:
+            index = buffer.find(separator)
+            if index >= 0:
+                data = buffer[:index]
+                buffer = buffer[index + len(separator):]
+            elif stream.eof:
+                raise MultipartError("Unexpected end of multipart body.")
+            else:
+                # retain the tail of the buffer, which might hold the
+                # beginning of the separator
+                tail = max(0, len(buffer) - len(separator) + 1)
+                data = buffer[:tail]
+                buffer = buffer[tail:]
+
+            if data and store is not None:
+                size += len(data)
+                if limit is not None and size > limit:
+                    if field_type is not None:
+                        store.close()
+                        raise LimitExceeded(
+                            "Upload exceeds size limit for '%s' "
+                            "(%d bytes)." % (name, limit))
+                    raise LimitExceeded(
+                        "Field exceeds size limit for '%s' "
+                        "(%d bytes)." % (name, limit))
+                if field_type is not None:
+                    store.write(data)
+                else:
+                    store.append(data)
+
+            if index >= 0:
+                break
+
+            buffer += stream.read()
+
+        if store is None:
+            continue
+
+        if field_type is None:
+            yield name, ''.join(store)
+        elif not filename and not size:
+            # an empty file input
+            store.close()
+            yield name, ''
+        else:
+            store.seek(0)
+            yield name, FileUpload(
+                name, store, filename.decode(charset, 'replace'),
+                headers.get('content-type'), size)
+
+
+def get_boundary(options):
+    """Return the boundary from the options of a ``Content-Type``
+    header (see ``cgi.parse_header``).
+
+        >>> from repoze.formapi.multipart import get_boundary
+        >>> get_boundary({})
+        Traceback (most recent call last):
+         ...
+        MultipartError: Missing multipart boundary.
+
+    """
+
+    boundary = options.get('boundary')
+    if not boundary:
+        raise MultipartError("Missing multipart boundary.")
+    return boundary
+
+
+class Stream(object):
+    """Reads a stream of ``length`` bytes in chunks."""
+
+    def __init__(self, read, length, bufsize=BUFSIZE):
+        self._read = read
+        self.length = length
+        self.bufsize = bufsize
+        self.eof = length <= 0
+
+    def read(self):
+        if self.eof:
+            return ''
+        chunk = self._read(min(self.bufsize, self.length))
+        self.length -= len(chunk)
+        if not chunk or self.length <= 0:
+            self.eof = True
+        return chunk
+
+
+def upload_type(schema, name):
+    """Return upload field type for ``name`` or ``None`` if the field
+    is not an upload field."""
+
+    try:
+        field = schema.lookup(name)
+    except (KeyError, TypeError):
+        return None
+
+    field_type = getattr(field, 'type', None)
+    if isinstance(field_type, type) and issubclass(field_type, FileUpload):
+        return field_type
@@ -1,14 +1,21 @@
 import pprint
 
+from timeit import default_timer as timer
+
 from repoze.formapi.py24 import defaultdict
+from repoze.formapi.py24 import json
 from repoze.formapi.error import Errors
+from repoze.formapi.cache import get_schema
+from repoze.formapi.schema import Node
 
 
-def parse(params, fields):
+def parse(params, fields, observer=None, lazy=False, repeated=None,
+          data=None, errors=None):
     """Return ``(data, errors)`` tuple.
 
     This function parses, converts and validates the parameter
-    sequence (name, value) pairs.
+    sequence (name, value) pairs. Alternatively, ``params`` may be a
+    nested dictionary or a file-like object with a JSON document.
 
     The converted data is returned as the ``data`` value, while errors
     encountered during conversion are set in the ``errors`` dict.
@@ -219,15 +226,151 @@ def parse(params, fields):
         >>> bool(errors['age'])
         True
 
+    An ``observer`` may be passed to receive an event for each
+    converted parameter (see the ``instrument`` module).
+
+    Nested input is walked against the fields definition directly; the
+    result is the same as for the equivalent dotted parameters.
+
+        >>> fields = {
+        ...     "user": {
+        ...         "name": str,
+        ...         "age": required(int),
+        ...         "friends": [str],
+        ...     }
+        ... }
+
+        >>> data, errors = parse({
+        ...     "user": {
+        ...         "name": "Fred Kaputnik",
+        ...         "age": "ten",
+        ...         "friends": ["stefan", "malthe"],
+        ...         "extra": {"ignored": True}},
+        ...     "security-token": "...",
+        ...     }, fields)
+
+        >>> data['user']['name']
+        'Fred Kaputnik'
+        >>> data['user']['friends']
+        ['stefan', 'malthe']
+        >>> 'extra' in data['user']
+        False
+        >>> bool(errors['user']['age'])
+        True
+
+    A JSON document is read from a file-like object.
+
+        >>> from StringIO import StringIO
+        >>> data, errors = parse(StringIO(
+        ...     '{"user": {"name": "Fred", "age": 42}}'), fields)
+
+        >>> data['user']['age']
+        42
+
+    Its keys are unicode; for levels of ``str`` keys, they're encoded,
+    while keys that do not conform to the type of a level are skipped.
+
+        >>> data, errors = parse(StringIO(
+        ...     '{"users": {"stefan": {"name": "Stefan"}},'
+        ...     ' "years": {"1975": "Four Wheel Drive", "1976": 1}}'),
+        ...     {'users': {str: {'name': str}}, 'years': {int: unicode}})
+
+        >>> data['users']['stefan']['name'], list(data['years'])
+        ('Stefan', [])
+
+    When a field that is not a sequence is submitted more than once,
+    each value is converted and the last one is used; errors are
+    reported for all values.
+
+        >>> data, errors = parse((
+        ...     ("user.age", "ten"), ("user.age", "42")), fields)
+        >>> data['user']['age'], errors['user']['age'][0]
+        (42, "invalid literal for int() with base 10: 'ten'")
+
+    The ``repeated`` argument sets a policy for such values: either
+    ``'first'`` or ``'last'``; the other values are discarded without
+    being converted.
+
+        >>> data, errors = parse((
+        ...     ("user.age", "ten"), ("user.age", "42")), fields,
+        ...     repeated='last')
+        >>> data['user']['age'], bool(errors)
+        (42, False)
+
+        >>> data, errors = parse((
+        ...     ("user.age", "ten"), ("user.age", "42")), fields,
+        ...     repeated='first')
+        >>> data['user']['age'], bool(errors)
+        ('ten', True)
+
+    With ``lazy`` set, parameter names are checked, but values are
+    converted when they're first read (see ``LazyParser``).
+
+        >>> data, errors = parse((
+        ...     ("user.name", "Fred"), ("user.age", "ten")), fields,
+        ...     lazy=True)
+
+        >>> data['user']['name']
+        'Fred'
+
+    The errors are complete once all values have been converted.
+
+        >>> bool(errors)
+        False
+
+        >>> data.materialize()
+        >>> bool(errors['user']['age'])
+        True
+
     """
 
-    data = Parser(fields)
-    errors = Errors()
+    if hasattr(params, 'read'):
+        params = json.load(params)
 
-    parsed_errors = Parser(fields, coerce=False)
+    nested = None
+    if isinstance(params, dict):
+        schema = get_schema(fields)
+        fields = schema.fields
+        if lazy or repeated is not None or observer is not None:
+            items = walk(params, schema.root)
+        else:
+            nested = schema.root
+    else:
+        items = split(params)
+
+    if repeated is not None:
+        items = discard_repeated(items, fields, repeated)
+
+    if lazy:
+        return defer(items, fields, observer)
+
+    # a parser and error tree may be passed in to be reused
+    if data is None or data.fields is not fields:
+        data = Parser(fields)
+    else:
+        data.clear()
+
+    if errors is None:
+        errors = Errors()
+    else:
+        errors.clear()
+
+    data.buffer()
+    if nested is not None:
+        apply_nested(params, nested, (), data, errors)
+    elif observer is not None:
+        observe(items, data, errors, observer)
+    else:
+        apply(items, data, errors)
+    data.finalize()
 
-    for name, value in params:
-        path = tuple(name.split('.'))
+    return data, errors
+
+
+def apply(items, data, errors):
+    """Parse items into ``data``, reporting conversion errors."""
+
+    for path, value in items:
         try:
             data[path] = value
         except KeyError:
@@ -238,13 +381,151 @@ def parse(params, fields):
                 e = e[p]
             e += str(error)
 
-    for path, message in parsed_errors:
-        e = errors
-        for p in path:
-            e = e[path]
-        e += message
 
-    return data, errors
+def apply_nested(mapping, node, prefix, data, errors):
+    """Parse a nested mapping into ``data`` (see ``walk``); the
+    compiled nodes resolve the field of each value, one level at a
+    time."""
+
+    dynamic = node.dynamic
+    children = node.children
+    for key, value in mapping.iteritems():
+        if dynamic is not None:
+            if dynamic is str and isinstance(key, unicode):
+                key = key.encode('utf-8')
+            if not isinstance(key, dynamic):
+                continue
+            child = children[dynamic]
+        else:
+            child = children.get(key)
+            if child is None:
+                continue
+
+        path = prefix + (key,)
+        if type(child) is Node:
+            if isinstance(value, dict):
+                apply_nested(value, child, path, data, errors)
+            continue
+        if isinstance(value, dict):
+            continue
+
+        try:
+            data.assign(path, child.definition, value)
+        except KeyError:
+            continue
+        except ValueError, error:
+            e = errors
+            for p in path:
+                e = e[p]
+            e += str(error)
+
+
+def discard_repeated(items, fields, policy):
+    """Return items with repeated values for fields that are not
+    sequences discarded; ``policy`` is either ``'first'`` or ``'last'``
+    (the value that is kept)."""
+
+    if policy not in ('first', 'last'):
+        raise ValueError("Policy must be 'first' or 'last' (got %r)." % (
+            policy,))
+
+    items = list(items)
+    if policy == 'last':
+        items.reverse()
+
+    traverse = Parser(fields).traverse
+    scalar = {}
+    seen = set()
+    result = []
+
+    for item in items:
+        path = item[0]
+        is_scalar = scalar.get(path)
+        if is_scalar is None:
+            try:
+                is_scalar = not isinstance(
+                    traverse(path), (list, tuple, dict))
+            except (KeyError, TypeError):
+                # the parser reports invalid names
+                is_scalar = False
+            scalar[path] = is_scalar
+
+        if is_scalar:
+            if path in seen:
+                continue
+            seen.add(path)
+        result.append(item)
+
+    if policy == 'last':
+        result.reverse()
+
+    return result
+
+
+def defer(items, fields, observer=None):
+    """Return ``(data, errors)`` for lazy parsing; names are checked
+    up front while values are kept as-is."""
+
+    data = LazyParser(fields, observer=observer)
+    check = data.traverse
+    pending = data.pending
+
+    for path, value in items:
+        try:
+            check(path)
+        except KeyError:
+            continue
+        pending.setdefault(path[0], []).append((path, value))
+
+    return data, data.errors
+
+
+def observe(items, data, errors, observer):
+    """Parse items, reporting conversion events to ``observer``."""
+
+    for path, value in items:
+        started = timer()
+        try:
+            data[path] = value
+        except KeyError:
+            continue
+        except ValueError, error:
+            observer.convert(path, value, timer() - started, True)
+            e = errors
+            for p in path:
+                e = e[p]
+            e += str(error)
+        else:
+            observer.convert(path, value, timer() - started, False)
+
+
+def split(params):
+    """Yield ``(path, value)`` pairs for dotted parameter names."""
+
+    for name, value in params:
+        yield tuple(name.split('.')), value
+
+
+def walk(mapping, node, path=()):
+    """Yield ``(path, value)`` pairs for the end-points of a nested
+    mapping, skipping entries that are not in the compiled ``node`` (or
+    do not conform to the type of its keys)."""
+
+    # keys of a JSON document are unicode
+    dynamic = getattr(node, 'dynamic', None)
+    for key, value in mapping.items():
+        if dynamic is str and isinstance(key, unicode):
+            key = key.encode('utf-8')
+        try:
+            child = node[key]
+        except (KeyError, TypeError):
+            continue
+
+        if isinstance(value, dict):
+            for item in walk(value, child, path + (key,)):
+                yield item
+        else:
+            yield path + (key,), value
 
 
 class Parser(object):
@@ -365,15 +646,24 @@ class Parser(object):
 
     """
 
-    def __init__(self, fields, data=None, path=(), coerce=True):
+    # keys of tuple values that are buffered as lists (see ``buffer``)
+    buffers = None
+
+    def __init__(self, fields, data=None, path=(), coerce=True, index=None):
         self.fields = fields
 
         if data is None:
             data = {}
 
+        # the index of keys (see ``__iter__``) is shared with the
+        # parsers of nested levels
+        if index is None:
+            index = {}
+
         self.data = data
         self.path = path
         self.coerce = coerce
+        self.index = index
 
     def __getitem__(self, path):
         if not isinstance(path, tuple):
@@ -394,27 +684,35 @@ class Parser(object):
             return ()
 
         if isinstance(data_type, dict):
-            return Parser(self.fields, self.data, path, self.coerce)
+            return Parser(
+                self.fields, self.data, path, self.coerce, self.index)
 
         return missing
 
     def __setitem__(self, path, value):
         if not isinstance(path, tuple):
             path = (path,)
-        key = self.path + tuple(path)
 
         # verify path; we want to raise an exception if the path does
         # not comply with the field definition
         data_type = self.traverse(path)
 
+        self.assign(self.path + tuple(path), data_type, value)
+
+    def assign(self, key, data_type, value):
+        """Set the value of the full path ``key``, which has been
+        verified to be of the field definition ``data_type``."""
+
         error = False
         if isinstance(data_type, (tuple, list)):
             if isinstance(value, (tuple, list)):
                 if key in self.data:
                     del self.data[key]
+                    self.index.clear()
             else:
                 value = (value,)
 
+            items = None
             for v in value:
                 if v is not None and self.coerce:
                     try:
@@ -422,14 +720,13 @@ class Parser(object):
                     except:
                         error = True
 
-                if isinstance(data_type, list):
-                    self.data.setdefault(
-                        key, []).append(v)
-                else:
-                    if key in self.data:
-                        self.data[key] += (v,)
-                    else:
-                        self.data[key] = (v,)
+                if items is None:
+                    items = self.sequence(key, data_type)
+                items.append(v)
+
+            # unbuffered tuples are built once per assignment
+            if items is not None and type(self.data[key]) is tuple:
+                self.data[key] = tuple(items)
         else:
             if value is not None and self.coerce:
                 try:
@@ -456,24 +753,85 @@ class Parser(object):
     def __nonzero__(self):
         return self.data.get(None, False)
 
+    def clear(self):
+        """Remove all values."""
+
+        self.data.clear()
+        self.index.clear()
+        self.buffers = None
+
+    def sequence(self, key, data_type):
+        """Return list to which values for ``key`` are appended."""
+
+        data = self.data
+        if isinstance(data_type, list):
+            return data.setdefault(key, [])
+
+        current = data.get(key)
+        if self.buffers is None:
+            # the caller builds the tuple
+            if current is None:
+                data[key] = ()
+                return []
+            return list(current)
+
+        if current is not None and key in self.buffers:
+            return current
+
+        items = list(current or ())
+        data[key] = items
+        self.buffers.add(key)
+        return items
+
+    def buffer(self):
+        """Accumulate tuple values in lists until ``finalize`` is
+        called; this avoids rebuilding a tuple for each value."""
+
+        if self.buffers is None:
+            self.buffers = set()
+
+    def finalize(self):
+        """Turn buffered values into tuples."""
+
+        buffers = self.buffers
+        if buffers is not None:
+            data = self.data
+            for key in buffers:
+                value = data.get(key)
+                if value is not None:
+                    data[key] = tuple(value)
+            self.buffers = None
+
     def __repr__(self):
         data = self.parse()
         return repr(data)
 
     def __iter__(self):
-        items = set()
+        index = self.index
+        if index.get(None) != len(self.data):
+            self.update_index()
+        return iter(index.get(self.path, ()))
+
+    def update_index(self):
+        """Index the keys of each level, in order of appearance; the
+        index is rebuilt when keys are added."""
+
+        index = self.index
+        index.clear()
+        seen = set()
         for path in self.data:
             if path is None:
                 continue
-
-            length = len(self.path)
-
-            if tuple(path[:length]) == self.path:
-                item = path[length]
-                if item not in items:
-                    yield item
-
-                items.add(item)
+            for i in range(len(path) - 1, -1, -1):
+                prefix = path[:i + 1]
+                if prefix in seen:
+                    break
+                seen.add(prefix)
+                keys = index.get(prefix[:-1])
+                if keys is None:
+                    keys = index[prefix[:-1]] = []
+                keys.append(path[i])
+        index[None] = len(self.data)
 
     def keys(self):
         return list(self)
@@ -524,12 +882,143 @@ class Parser(object):
         return fields
 
 
+class LazyParser(Parser):
+    """Parser which converts values on first access.
+
+    The raw values are kept by the first segment of their path; when a
+    path is read, the pending values under the path are converted (in
+    the order they were submitted). The ``errors`` attribute is only
+    complete after ``materialize`` has been called.
+
+        >>> from repoze.formapi.parser import parse
+        >>> data, errors = parse((
+        ...     ('id', '42'), ('title', 'Moonmadness'),
+        ...     ('year', 'late'), ('tracks.a1', '190')), {
+        ...     'id': int, 'title': str, 'year': int,
+        ...     'tracks': {str: int}}, lazy=True)
+
+        >>> data['id']
+        42
+
+    The other values have not been converted.
+
+        >>> sorted(data.pending)
+        ['title', 'tracks', 'year']
+
+        >>> data['tracks']['a1']
+        190
+
+    Iteration and truth testing convert all values.
+
+        >>> bool(data)
+        True
+
+        >>> data.pending
+        {}
+
+        >>> errors['year'][0]
+        "invalid literal for int() with base 10: 'late'"
+
+    """
+
+    def __init__(self, fields, data=None, path=(), coerce=True,
+                 pending=None, errors=None, observer=None, index=None):
+        Parser.__init__(self, fields, data, path, coerce, index)
+        if pending is None:
+            pending = {}
+        if errors is None:
+            errors = Errors()
+        self.pending = pending
+        self.errors = errors
+        self.observer = observer
+
+    def __getitem__(self, path):
+        if not isinstance(path, tuple):
+            path = (path,)
+        path = self.path + path
+
+        # dictionary levels convert on access of their entries
+        if isinstance(self.traverse(path), dict):
+            return LazyParser(
+                self.fields, self.data, path, self.coerce,
+                self.pending, self.errors, self.observer, self.index)
+
+        self.convert(path)
+        return Parser.__getitem__(self, path[len(self.path):])
+
+    def __setitem__(self, path, value):
+        if not isinstance(path, tuple):
+            path = (path,)
+        self.convert(self.path + path)
+        Parser.__setitem__(self, path, value)
+
+    def __nonzero__(self):
+        self.materialize()
+        return Parser.__nonzero__(self)
+
+    def __iter__(self):
+        self.convert(self.path)
+        return Parser.__iter__(self)
+
+    def parse(self):
+        self.materialize()
+        return Parser.parse(self)
+
+    def materialize(self):
+        """Convert all pending values."""
+
+        self.convert(())
+
+    def convert(self, prefix):
+        """Convert the pending values under the path ``prefix``."""
+
+        pending = self.pending
+        if not pending:
+            return
+
+        if prefix:
+            items = pending.get(prefix[0])
+            if not items:
+                return
+            length = len(prefix)
+            if length > 1:
+                selected = []
+                remaining = []
+                for item in items:
+                    if item[0][:length] == prefix:
+                        selected.append(item)
+                    else:
+                        remaining.append(item)
+                if remaining:
+                    pending[prefix[0]] = remaining
+                    items = selected
+                else:
+                    del pending[prefix[0]]
+            else:
+                del pending[prefix[0]]
+        else:
+            items = []
+            for values in pending.values():
+                items.extend(values)
+            pending.clear()
+
+        data = Parser(self.fields, self.data, index=self.index)
+        data.buffer()
+        if self.observer is not None:
+            observe(items, data, self.errors, self.observer)
+        else:
+            apply(items, data, self.errors)
+        data.finalize()
+
+
 def required(cls, msg="Required field"):
     class required(cls):
         def __new__(base, value):
             if not value:
                 raise MissingError(msg)
             return cls(value)
+    required.wrapped = cls
+    required.msg = msg
     return required
 
 
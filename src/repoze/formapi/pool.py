@@ -0,0 +1,114 @@
+import threading
+
+
+class Pool(object):
+    """Pool of reusable form instances.
+
+    Forms are obtained with ``get``, which takes the arguments of the
+    form constructor, and returned with ``put``; a returned form is
+    cleared (see ``Form.clear``) such that it does not keep references
+    to its input. At most ``size`` forms are kept. Each form class has
+    a pool (see ``Form.pool``).
+
+        >>> class TapeForm(Form):
+        ...     fields = {'title': unicode, 'year': int}
+        ...     prefix = 'tape'
+        ...
+        ...     @action('save')
+        ...     def save(self, data):
+        ...         return data['title']
+
+        >>> pool = TapeForm.pool
+        >>> form = pool.get(params=(
+        ...     ('title', u'Rain Dances'), ('year', 'late'),
+        ...     ('tape.save', '')))
+        >>> form.validate()
+        False
+        >>> pool.put(form)
+
+    The form instance is reused.
+
+        >>> pool.get(params=(('title', u'Moonmadness'), ('tape.save', ''))) \\
+        ...     is form
+        True
+
+    Nothing from the previous use is kept.
+
+        >>> form.validate(), form(), form.data['year']
+        (True, u'Moonmadness', None)
+
+        >>> pool.put(form)
+        >>> form._parser.data
+        {}
+
+        >>> form = pool.get()
+        >>> form.action, form.status, form.data['title']
+        (None, None, None)
+
+    Returning a form is not observed as a use of the form (see
+    ``instrument``).
+
+        >>> from repoze.formapi import instrument
+        >>> aggregator = instrument.Aggregator()
+        >>> instrument.install(aggregator)
+        >>> pool.put(form)
+        >>> form = pool.get(params=(('title', u'Hergest Ridge'),
+        ...                         ('tape.save', '')))
+        >>> pool.put(form)
+        >>> instrument.uninstall()
+
+        >>> [(key, count) for (key, count, total, worst)
+        ...  in aggregator.items() if key.endswith('actions')]
+        [('TapeForm actions', 1)]
+
+    Only forms of the pool's form class are accepted.
+
+        >>> pool.put(Form())
+        Traceback (most recent call last):
+         ...
+        TypeError: Expected instance of TapeForm (got Form).
+
+    """
+
+    def __init__(self, form_class, size=8):
+        self.form_class = form_class
+        self.size = size
+        self.lock = threading.Lock()
+        self.forms = []
+
+    def __len__(self):
+        return len(self.forms)
+
+    def get(self, *args, **kwargs):
+        """Return a form for the input provided as arguments."""
+
+        self.lock.acquire()
+        try:
+            if self.forms:
+                form = self.forms.pop()
+            else:
+                form = None
+        finally:
+            self.lock.release()
+
+        if form is None:
+            return self.form_class(*args, **kwargs)
+
+        form.reset(*args, **kwargs)
+        return form
+
+    def put(self, form):
+        """Return a form to the pool."""
+
+        if type(form) is not self.form_class:
+            raise TypeError("Expected instance of %s (got %s)." % (
+                self.form_class.__name__, type(form).__name__))
+
+        form.clear()
+
+        self.lock.acquire()
+        try:
+            if len(self.forms) < self.size:
+                self.forms.append(form)
+        finally:
+            self.lock.release()
@@ -36,6 +36,19 @@ except:
             return 'defaultdict(%s, %s)' % (self.default_factory,
                                             dict.__repr__(self))
 
+from collections import deque
+try:
+    deque(maxlen=1)
+except TypeError:
+    class deque(deque):
+        def __init__(self, iterable=(), maxlen=None):
+            super(deque, self).__init__(iterable)
+            self.maxlen = maxlen
+        def append(self, item):
+            super(deque, self).append(item)
+            if self.maxlen is not None and len(self) > self.maxlen:
+                self.popleft()
+
 try:
     __builtins__.any
 except AttributeError:
@@ -44,3 +57,11 @@ except AttributeError:
             if item:
                 return True
         return False
+
+try:
+    import json
+except ImportError:
+    try:
+        import simplejson as json
+    except ImportError:
+        json = None
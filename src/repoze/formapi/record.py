@@ -0,0 +1,235 @@
+"""Record output.
+
+Parsed input is usually read through the parser (or as nested
+dictionaries, see ``Parser.parse``). Records are a compact
+alternative: each static level of the fields definition is represented
+by a generated class with ``__slots__`` and each level of dynamic keys
+by a dictionary. Values that are not set are ``missing``.
+
+The classes are generated once per compiled schema (see
+``get_record``); records are built directly from the values of a
+parser (see ``build``)."""
+
+import re
+import keyword
+
+from repoze.formapi.parser import LazyParser
+from repoze.formapi.parser import missing
+from repoze.formapi.schema import Node
+from repoze.formapi.cache import get_schema
+
+re_identifier = re.compile(r'^[A-Za-z][A-Za-z0-9_]*$')
+
+
+class Record(object):
+    """Base class of generated records.
+
+    Values are available as attributes and items; keys that are not
+    valid attribute names (or that start with an underscore) are only
+    available as items.
+
+        >>> from repoze.formapi.record import get_record
+        >>> from repoze.formapi.schema import Schema
+        >>> from repoze.formapi.parser import missing
+        >>> TapeRecord = get_record(Schema({
+        ...     'title': unicode, 'tracks': [int], 'catalog-no': str}))
+
+        >>> record = TapeRecord()
+        >>> record.title = u'Moonmadness'
+        >>> record['catalog-no'] = 'SRLZ 1073'
+
+        >>> record
+        Record(catalog-no='SRLZ 1073', title=u'Moonmadness')
+
+        >>> record['title'], record.tracks is missing
+        (u'Moonmadness', True)
+
+        >>> list(record), 'tracks' in record
+        (['catalog-no', 'title'], False)
+
+    Records have slots for the keys of the level only.
+
+        >>> record.year = 1976
+        Traceback (most recent call last):
+         ...
+        AttributeError: 'Record' object has no attribute 'year'
+
+        >>> record['year']
+        Traceback (most recent call last):
+         ...
+        KeyError: 'year'
+
+    """
+
+    __slots__ = ()
+
+    # (key, slot name) in order; the mapping of keys to slot names;
+    # the factories of nested levels
+    _order = ()
+    _slots = {}
+    _names = frozenset()
+    _factories = {}
+
+    def __getattr__(self, name):
+        # slots that are not set
+        if name in self._names:
+            return missing
+        raise AttributeError(name)
+
+    def __getitem__(self, key):
+        return getattr(self, self._slots[key])
+
+    def __setitem__(self, key, value):
+        setattr(self, self._slots[key], value)
+
+    def __contains__(self, key):
+        slot = self._slots.get(key)
+        return slot is not None and getattr(self, slot) is not missing
+
+    def __iter__(self):
+        """Iterate over the keys that are set."""
+
+        for key, slot in self._order:
+            if getattr(self, slot) is not missing:
+                yield key
+
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__, ', '.join([
+            '%s=%r' % (key, self[key]) for key in self]))
+
+    def _asdict(self):
+        """Return a dictionary of the values that are set."""
+
+        return dict([(key, self[key]) for key in self])
+
+    def _enter(self, key):
+        """Return the nested level ``key``, creating it if not set."""
+
+        slot = self._slots[key]
+        value = getattr(self, slot)
+        if value is missing:
+            value = self._factories[key]()
+            setattr(self, slot, value)
+        return value
+
+
+class Records(dict):
+    """Base class of levels of dynamic keys; keys that are not set
+    are ``missing``."""
+
+    __slots__ = ()
+
+    # the factory of nested levels (if any)
+    _factory = None
+
+    def __missing__(self, key):
+        return missing
+
+    def _enter(self, key):
+        value = self.get(key)
+        if value is None:
+            value = self[key] = self._factory()
+        return value
+
+
+def build(parser):
+    """Return a record of the values of ``parser``.
+
+        >>> from repoze.formapi.record import build
+        >>> from repoze.formapi.parser import parse, missing
+        >>> data, errors = parse((
+        ...     ('title', u'Moonmadness'), ('tracks.a1.length', '190'),
+        ...     ('tracks.a1.title', u'Aroma de Tierra')), {
+        ...     'title': unicode, 'year': int,
+        ...     'tracks': {str: {'title': unicode, 'length': int}}})
+
+        >>> record = build(data)
+        >>> record.title, record.year is missing
+        (u'Moonmadness', True)
+
+        >>> record.tracks['a1']
+        Record(length=190, title=u'Aroma de Tierra')
+
+        >>> record.tracks['b1'] is missing
+        True
+
+    Pending values of a lazy parser are converted first.
+
+    """
+
+    if isinstance(parser, LazyParser):
+        parser.materialize()
+
+    record = get_record(get_schema(parser.fields))()
+
+    # nested levels by path, with their slot names (``None`` for
+    # levels of dynamic keys)
+    levels = {(): (record, getattr(record, '_slots', None))}
+    for path, value in parser.data.iteritems():
+        if path is None:
+            continue
+        prefix = path[:-1]
+        entry = levels.get(prefix)
+        if entry is None:
+            level = record
+            for key in prefix:
+                level = level._enter(key)
+            entry = levels[prefix] = level, getattr(level, '_slots', None)
+        level, slots = entry
+        if slots is None:
+            level[path[-1]] = value
+        else:
+            setattr(level, slots[path[-1]], value)
+    return record
+
+
+def get_record(schema):
+    """Return the record class of the compiled ``schema``; it's kept
+    with the schema (see ``cache``)."""
+
+    record = schema.__dict__.get('record')
+    if record is None:
+        record = schema.record = record_class(schema.root)
+    return record
+
+
+def record_class(node):
+    """Return a record class for a compiled dictionary level."""
+
+    if node.dynamic is not None:
+        child = node.children[node.dynamic]
+        factory = None
+        if isinstance(child, Node):
+            factory = record_class(child)
+        return type('Records', (Records,), {
+            '__slots__': (), '_factory': factory})
+
+    order = []
+    factories = {}
+    for index, (key, child) in enumerate(node.static):
+        order.append((key, slot_name(key, index)))
+        if isinstance(child, Node):
+            factories[key] = record_class(child)
+
+    names = tuple([slot for (key, slot) in order])
+    return type('Record', (Record,), {
+        '__slots__': names,
+        '_order': tuple(order),
+        '_slots': dict(order),
+        '_names': frozenset(names),
+        '_factories': factories,
+        })
+
+
+def slot_name(key, index):
+    """Return the attribute name of a key; keys that are not valid
+    names are given a private one."""
+
+    if isinstance(key, unicode):
+        try:
+            key = key.encode('ascii')
+        except UnicodeError:
+            return '_%d' % index
+    if re_identifier.match(key) is None or keyword.iskeyword(key):
+        return '_%d' % index
+    return key
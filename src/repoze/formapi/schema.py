@@ -0,0 +1,329 @@
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
+
+
+class Schema(object):
+    """Compiled field definition.
+
+    The schema is compiled once from a ``fields`` definition and
+    answers the question of whether a parameter name conforms to the
+    definition, without creating any data structures.
+
+        >>> from repoze.formapi.schema import Schema
+        >>> schema = Schema({
+        ...     'name': str,
+        ...     'tags': [str],
+        ...     'users': {
+        ...         str: {
+        ...            'username': str,
+        ...            'id': int}
+        ...         }
+        ...     })
+
+    Fully static names are available from a lookup table.
+
+        >>> sorted(schema.names)
+        ['name', 'tags', 'users']
+
+        >>> 'name' in schema
+        True
+
+        >>> 'users.foo.id' in schema
+        True
+
+        >>> 'users.foo.bar' in schema
+        False
+
+        >>> 'foo' in schema
+        False
+
+    We can look up the end-point of a name.
+
+        >>> schema.lookup('users.foo.id')
+        <Field users.*.id int>
+
+        >>> schema.lookup('tags')
+        <Field tags [str]>
+
+    The compiled schema raises the same exceptions as the parser for
+    names that do not conform.
+
+        >>> schema.lookup('users.foo.bar')
+        Traceback (most recent call last):
+         ...
+        KeyError: 'bar'
+
+        >>> schema.lookup('name.foo')
+        Traceback (most recent call last):
+         ...
+        TypeError: Sequences are only allowed as end-points.
+
+    Names that raise a ``TypeError`` are considered part of the
+    schema; parsing them will raise the exception.
+
+        >>> 'name.foo' in schema
+        True
+
+    """
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.root = compile_node(fields, ())
+        self.names = {}
+        self.root.register(self.names)
+
+    def __contains__(self, name):
+        try:
+            self.lookup(name)
+        except KeyError:
+            return False
+        except TypeError:
+            pass
+        return True
+
+    def lookup(self, name):
+        """Return the compiled node for the dotted parameter ``name``."""
+
+        node = self.names.get(name)
+        if node is not None:
+            return node
+        return self.traverse(name.split('.'))
+
+    def traverse(self, path):
+        """Return the compiled node for the path segments ``path``."""
+
+        node = self.root
+        for segment in path:
+            node = node[segment]
+        return node
+
+
+class Node(object):
+    """Compiled dictionary level of a field definition."""
+
+    def __init__(self, fields, path):
+        self.path = path
+        self.dynamic = None
+
+        if len(fields) == 1:
+            key = fields.keys()[0]
+            if key in (str, unicode, int):
+                self.dynamic = key
+
+        self.children = {}
+        for key, value in fields.items():
+            self.children[key] = compile_node(value, path + (key,))
+
+        # static children in a stable order
+        self.static = [
+            (key, child) for (key, child) in sorted(self.children.items())
+            if isinstance(key, basestring)]
+
+    def __getitem__(self, key):
+        dynamic = self.dynamic
+        if dynamic is not None:
+            # make sure value conforms to data type
+            if not isinstance(key, dynamic):
+                raise TypeError(
+                    "Must be type '%s' (got '%s')." % (
+                    (dynamic.__name__, type(key).__name__)))
+            return self.children[dynamic]
+        return self.children[key]
+
+    def __repr__(self):
+        return '<%s %s>' % (type(self).__name__, self.name)
+
+    @property
+    def name(self):
+        return format_path(self.path)
+
+    def register(self, names, prefix=''):
+        if self.dynamic is not None:
+            return
+        for key, child in self.children.items():
+            if isinstance(key, basestring):
+                name = prefix + key
+                names[name] = child
+                child.register(names, name + '.')
+
+
+class Field(object):
+    """Compiled end-point of a field definition.
+
+    The ``type`` attribute is the callable used for conversion; the
+    ``sequence`` attribute is either ``None``, ``list`` or ``tuple``.
+    """
+
+    def __init__(self, type, path):
+        self.path = path
+        # the definition as given (see ``Parser.assign``)
+        self.definition = type
+        if isinstance(type, (list, tuple)):
+            self.sequence = (list, tuple)[isinstance(type, tuple)]
+            type = type[0]
+        else:
+            self.sequence = None
+        self.type = type
+
+    def __getitem__(self, key):
+        raise TypeError(
+            "Sequences are only allowed as end-points.")
+
+    def __repr__(self):
+        name = getattr(self.type, '__name__', repr(self.type))
+        if self.sequence is list:
+            name = '[%s]' % name
+        elif self.sequence is tuple:
+            name = '(%s,)' % name
+        return '<%s %s %s>' % (type(self).__name__, self.name, name)
+
+    @property
+    def name(self):
+        return format_path(self.path)
+
+    def register(self, names, prefix=''):
+        pass
+
+
+class FrozenDict(dict):
+    """Read-only dictionary."""
+
+    def __readonly__(self, *args, **kwargs):
+        raise TypeError("Fields definition is read-only.")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = \
+                  setdefault = update = __readonly__
+
+    def __reduce__(self):
+        return type(self), (dict(self),)
+
+
+class FrozenList(list):
+    """Read-only list."""
+
+    def __readonly__(self, *args, **kwargs):
+        raise TypeError("Fields definition is read-only.")
+
+    __setitem__ = __delitem__ = __setslice__ = __delslice__ = \
+                  __iadd__ = __imul__ = append = extend = insert = \
+                  pop = remove = reverse = sort = __readonly__
+
+    def __reduce__(self):
+        return type(self), (list(self),)
+
+
+def freeze(fields):
+    """Return a read-only copy of a fields definition.
+
+        >>> from repoze.formapi.schema import freeze
+        >>> fields = freeze({'name': str, 'users': {str: [int]}})
+
+        >>> fields['name'] = unicode
+        Traceback (most recent call last):
+         ...
+        TypeError: Fields definition is read-only.
+
+        >>> fields['users'][str].append(str)
+        Traceback (most recent call last):
+         ...
+        TypeError: Fields definition is read-only.
+
+    The copy compares equal to the original and can be used to derive
+    new fields definitions.
+
+        >>> fields == {'name': str, 'users': {str: [int]}}
+        True
+
+        >>> dict(fields, name=unicode)['name']
+        <type 'unicode'>
+
+    Frozen definitions are returned as-is.
+
+        >>> freeze(fields) is fields
+        True
+
+    """
+
+    if isinstance(fields, (FrozenDict, FrozenList)):
+        return fields
+    if isinstance(fields, dict):
+        return FrozenDict([
+            (key, freeze(value)) for (key, value) in fields.items()])
+    if isinstance(fields, list):
+        return FrozenList(map(freeze, fields))
+    if isinstance(fields, tuple):
+        return tuple(map(freeze, fields))
+    return fields
+
+
+def compile_node(fields, path):
+    if isinstance(fields, dict):
+        return Node(fields, path)
+    return Field(fields, path)
+
+
+def fingerprint(fields):
+    """Return structural hash of a fields definition.
+
+    Field types are identified by module and name, such that the hash
+    is stable across processes.
+
+        >>> from repoze.formapi.schema import fingerprint
+        >>> from repoze.formapi import required
+        >>> fingerprint({'name': str, 'ids': [int]})
+        '26346c34...'
+
+        >>> fingerprint({'ids': [int], 'name': str}) == \\
+        ...     fingerprint({'name': str, 'ids': [int]})
+        True
+
+        >>> fingerprint({'name': str}) == fingerprint({'name': unicode})
+        False
+
+        >>> fingerprint({'name': required(str)}) == \\
+        ...     fingerprint({'name': required(str)})
+        True
+
+    """
+
+    return md5(describe(fields)).hexdigest()
+
+
+def describe(fields):
+    if isinstance(fields, dict):
+        return '{%s}' % ','.join(sorted([
+            '%s:%s' % (describe(key), describe(value))
+            for (key, value) in fields.items()]))
+
+    if isinstance(fields, list):
+        return '[%s]' % ','.join(map(describe, fields))
+
+    if isinstance(fields, tuple):
+        return '(%s,)' % ','.join(map(describe, fields))
+
+    if isinstance(fields, basestring):
+        return repr(fields)
+
+    wrapped = getattr(fields, 'wrapped', None)
+    if wrapped is not None:
+        return 'required(%s,%r)' % (describe(wrapped), fields.msg)
+
+    name = getattr(fields, '__name__', None)
+    if name is None:
+        return repr(fields)
+
+    module = getattr(fields, '__module__', None)
+    description = '%s.%s' % (module, name)
+
+    max_size = getattr(fields, 'max_size', None)
+    if max_size is not None:
+        description += '(%r)' % max_size
+
+    return description
+
+
+def format_path(path):
+    return '.'.join([
+        isinstance(key, basestring) and key or '*' for key in path])
@@ -0,0 +1,409 @@
+"""Local validation service.
+
+The server loads a set of form classes once and validates batches of
+records for other processes on the same host (e.g. a frontend server
+in another language) over a Unix domain socket; validation runs in a
+pool of worker processes (see ``bulk``). Run it with::
+
+  $ python -m repoze.formapi.service --socket /tmp/forms.sock \\
+        --form tape=myapp.forms.TapeForm
+
+The protocol is line-based: each request and response is a JSON
+document on a single line. A request names a configured form and
+gives a list of records, each either a list of ``[name, value]``
+pairs or a nested object::
+
+  {"form": "tape", "records": [[["title", "Moonmadness"]]]}
+
+The response has a result for each record, in order; the errors are
+``[name, message]`` pairs (a record is valid if there are none)::
+
+  {"results": [{"data": {"title": "Moonmadness", "year": null},
+                "errors": []}]}
+
+A request that fails (e.g. for an unknown form) has an ``error``
+response. Form actions are not called; the optional ``prefix`` of a
+request is used for action detection only. With ``"data": false``,
+the data is left out of the results."""
+
+import os
+import sys
+import stat
+import signal
+import socket
+import optparse
+import SocketServer
+
+from repoze.formapi.bulk import bulk
+from repoze.formapi.schema import Node
+from repoze.formapi.state import is_plain
+from repoze.formapi.state import serialize
+from repoze.formapi.capture import resolve
+from repoze.formapi.py24 import json
+
+# the maximum length of a request line
+MAX_SIZE = 16 * 1024 * 1024
+
+
+class Server(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    """Validation server for ``forms`` (a mapping of names to form
+    classes or their dotted names) on the socket ``path``.
+
+    Batches are split into chunks of ``chunksize`` records which are
+    validated by a pool of ``processes`` worker processes (by default,
+    one per CPU); with no processes, records are validated in the
+    thread of the connection.
+
+        >>> import os, tempfile, threading
+        >>> from repoze.formapi.service import Server, Client
+
+        >>> class TapeForm(Form):
+        ...     fields = {'title': required(unicode), 'year': int,
+        ...               'tracks': {str: {'length': int}}}
+        ...
+        ...     @validator('year')
+        ...     def check_year(self):
+        ...         year = self.data['year']
+        ...         if year is not None and year < 1900:
+        ...             yield "Too early"
+
+        >>> path = os.path.join(tempfile.mkdtemp(), 'forms.sock')
+        >>> server = Server({'tape': TapeForm}, path, processes=0)
+        >>> thread = threading.Thread(target=server.serve_forever)
+        >>> thread.start()
+
+        >>> client = Client(path)
+        >>> results = client.validate('tape', [
+        ...     [('title', u'Moonmadness'), ('tracks.a1.length', '138')],
+        ...     {'title': u'', 'year': '1876'}])
+
+        >>> for result in results:
+        ...     print sorted(result['data'].items())
+        ...     print result['errors']
+        [(u'title', u'Moonmadness'), (u'tracks', {u'a1': {u'length': 138}}),
+         (u'year', None)]
+        []
+        [(u'title', None), (u'tracks', {}), (u'year', 1876)]
+        [[u'title', u'Required field'], [u'year', u'Too early']]
+
+    Failed requests raise a ``ValueError``; the connection remains
+    usable.
+
+        >>> client.validate('album', [])
+        Traceback (most recent call last):
+         ...
+        ValueError: Unknown form: album.
+
+        >>> client.validate(u'b\\xe4nd', [])
+        Traceback (most recent call last):
+         ...
+        ValueError: Unknown form: b\\xe4nd.
+
+        >>> client.validate('tape', [[('year', 'late')]], data=False)
+        [{u'errors': [[u'year', u"invalid literal for int()..."]]}]
+
+    The socket is only accessible with the permissions of ``mode``
+    (by default, to the owner).
+
+        >>> import stat
+        >>> oct(stat.S_IMODE(os.stat(path).st_mode))
+        '0600'
+
+        >>> client.close()
+        >>> server.shutdown()
+        >>> thread.join()
+        >>> server.server_close()
+        >>> os.path.exists(path)
+        False
+
+    A socket that is left behind is replaced; other files are not.
+
+        >>> open(path, 'w').close()
+        >>> Server({'tape': TapeForm}, path, processes=0)
+        Traceback (most recent call last):
+         ...
+        ValueError: Not a socket: ....
+
+        >>> os.remove(path)
+
+    """
+
+    daemon_threads = True
+
+    def __init__(self, forms, path, processes=None, chunksize=50,
+                 mode=0600):
+        self.forms = {}
+        for name, form_class in forms.items():
+            if isinstance(form_class, basestring):
+                form_class = resolve(form_class)
+            # compile the schema before the workers are started
+            form_class.schema
+            self.forms[name] = form_class
+
+        # a socket file that is left behind is replaced, but no other
+        # kind of file
+        try:
+            if not stat.S_ISSOCK(os.lstat(path).st_mode):
+                raise ValueError("Not a socket: %s." % path)
+            os.remove(path)
+        except OSError:
+            pass
+
+        self.chunksize = chunksize
+        if processes == 0:
+            self.pool = None
+        else:
+            from multiprocessing import Pool
+            from multiprocessing import cpu_count
+            if processes is None:
+                processes = cpu_count()
+            self.pool = Pool(processes, ignore_interrupt)
+        self.processes = processes
+
+        # the socket is created with the permissions of ``mode``
+        umask = os.umask(0777 & ~mode)
+        try:
+            SocketServer.UnixStreamServer.__init__(self, path, Handler)
+        finally:
+            os.umask(umask)
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+
+    def process(self, request):
+        """Return the response for a (decoded) request."""
+
+        if not isinstance(request, dict):
+            raise ValueError("Invalid request.")
+
+        name = request.get('form')
+        form_class = self.forms.get(name)
+        if form_class is None:
+            raise ValueError("Unknown form: %s." % name)
+
+        records = request.get('records')
+        if not isinstance(records, list):
+            raise ValueError("Invalid records.")
+
+        prefix = request.get('prefix')
+        if prefix is None:
+            prefix = form_class.prefix
+        elif isinstance(prefix, unicode):
+            prefix = prefix.encode('utf-8')
+
+        root = form_class.schema.root
+        include_data = request.get('data', True)
+
+        results = []
+        for outcome in bulk(
+            form_class, [native(record) for record in records], prefix,
+            self.chunksize, self.pool, 2 * self.processes, call=False):
+            result = {'errors': [
+                ['.'.join([unicode(key) for key in path]), message]
+                for (path, message) in outcome.errors]}
+            if include_data:
+                result['data'] = export(outcome.data, root)
+            results.append(result)
+
+        return {'results': results}
+
+
+class Handler(SocketServer.StreamRequestHandler):
+    """Handles the requests of a connection."""
+
+    def handle(self):
+        try:
+            self.serve()
+        except socket.error:
+            # the client went away
+            pass
+
+    def serve(self):
+        while True:
+            line = self.rfile.readline(MAX_SIZE + 1)
+            if not line:
+                break
+
+            if len(line) > MAX_SIZE:
+                self.respond({'error': "Request too large."})
+                break
+
+            try:
+                response = self.server.process(json.loads(line))
+            except Exception, exc:
+                response = {'error': error_message(exc)}
+
+            self.respond(response)
+
+    def respond(self, response):
+        self.wfile.write(dumps(response))
+        self.wfile.flush()
+
+
+class Client(object):
+    """Client of a validation server on the socket ``path``; the
+    connection is opened on first use."""
+
+    def __init__(self, path):
+        self.path = path
+        self.socket = None
+        self.file = None
+
+    def connect(self):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(self.path)
+        self.file = self.socket.makefile('rb')
+
+    def close(self):
+        if self.socket is not None:
+            self.file.close()
+            self.socket.close()
+            self.socket = self.file = None
+
+    def validate(self, form, records, prefix=None, data=True):
+        """Validate ``records`` with the form named ``form``; returns
+        a list of results (see the module documentation)."""
+
+        request = {'form': form, 'records': records}
+        if prefix is not None:
+            request['prefix'] = prefix
+        if not data:
+            request['data'] = False
+
+        if self.socket is None:
+            self.connect()
+
+        try:
+            self.socket.sendall(dumps(request))
+            line = self.file.readline()
+        except socket.error:
+            self.close()
+            raise
+
+        if not line:
+            self.close()
+            raise IOError("Connection closed by server.")
+
+        response = json.loads(line)
+        if 'error' in response:
+            raise ValueError(response['error'])
+        return response['results']
+
+
+def ignore_interrupt():
+    # workers are stopped by the server
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def error_message(exc):
+    try:
+        message = unicode(exc)
+    except UnicodeError:
+        message = str(exc).decode('utf-8', 'replace')
+    return message or unicode(type(exc).__name__)
+
+
+def dumps(document):
+    return json.dumps(document, separators=(',', ':')) + '\n'
+
+
+def native(params):
+    """Return record with names (and keys) as byte strings, like
+    those of a request."""
+
+    if isinstance(params, dict):
+        result = {}
+        for key, value in params.items():
+            if isinstance(key, unicode):
+                key = key.encode('utf-8')
+            if isinstance(value, dict):
+                value = native(value)
+            result[key] = value
+        return result
+
+    if not isinstance(params, list):
+        raise ValueError("Invalid record.")
+
+    result = []
+    for pair in params:
+        name, value = pair
+        if isinstance(name, unicode):
+            name = name.encode('utf-8')
+        result.append((name, value))
+    return result
+
+
+def export(data, node):
+    """Return (plain) form ``data`` with values that can be encoded
+    as JSON; field types may define a ``serialize`` method."""
+
+    result = {}
+    for key, value in data.items():
+        child = node[key]
+        if isinstance(child, Node):
+            value = export(value, child)
+        elif not is_plain(value):
+            value = export_value(child, value)
+        result[key] = value
+    return result
+
+
+def export_value(field, value):
+    if isinstance(value, (list, tuple)):
+        return [export_value(field, item) for item in value]
+    if is_plain(value):
+        return value
+    try:
+        return serialize(field.type, value)
+    except (TypeError, ValueError):
+        return None
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option(
+        "-s", "--socket", metavar="PATH",
+        help="Path of the Unix domain socket.")
+    parser.add_option(
+        "-f", "--form", action="append", default=[], metavar="NAME=CLASS",
+        help="Form class (dotted name) to serve under a name.")
+    parser.add_option(
+        "-p", "--processes", type="int", default=None,
+        help="Number of worker processes (default: one per CPU).")
+    parser.add_option(
+        "-c", "--chunksize", type="int", default=50,
+        help="Number of records per chunk of work.")
+
+    options, args = parser.parse_args(argv)
+    if not options.socket:
+        parser.error("No socket path given.")
+    if not options.form:
+        parser.error("No forms given.")
+
+    forms = {}
+    for option in options.form:
+        name, sep, dotted = option.partition('=')
+        if not sep:
+            parser.error("Invalid form option: %s." % option)
+        forms[name] = dotted
+
+    server = Server(
+        forms, options.socket, options.processes, options.chunksize)
+    try:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    finally:
+        server.server_close()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
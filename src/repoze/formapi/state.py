@@ -0,0 +1,453 @@
+"""Serialized form state.
+
+The parsed state of a form is serialized as a compact, versioned
+structure which can be kept between requests (e.g. in the session of
+a multi-step wizard); a form is restored from it without parsing the
+input of previous steps again.
+
+Values are keyed by the index of their field in the compiled schema
+and the dynamic keys of their path (instead of the full path). Each
+value carries a conversion status:
+
+``VALUE``
+  The converted value is stored as-is (a value of a basic type).
+
+``SERIALIZED``
+  The converted value is stored as text (see ``serialize``) and
+  converted again when it's first read.
+
+``INVALID``
+  The input did not convert; the value is stored as-is.
+
+The error messages of a field follow its value.
+
+The state is a tuple of basic types; it's only valid for the fields
+definition it was dumped from (see ``fingerprint``). It's meant to be
+kept on the server. A state that is passed through the client (e.g.
+in a hidden field) must be signed, see ``dumps``."""
+
+import hmac
+import marshal
+
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import sha as sha1
+
+from repoze.formapi.parser import Parser
+from repoze.formapi.parser import LazyParser
+from repoze.formapi.parser import parse
+from repoze.formapi.cache import get_schema
+from repoze.formapi.schema import fingerprint
+from repoze.formapi.multipart import FileUpload
+
+VERSION = 1
+
+VALUE = 0
+SERIALIZED = 1
+INVALID = 2
+
+plain_types = frozenset((
+    type(None), bool, int, long, float, str, unicode))
+
+
+def dump(form):
+    """Return the parsed state of ``form``.
+
+    Only input is included; changes made to the form data after
+    parsing are not part of the state.
+
+        >>> from repoze.formapi.converters import isodate
+        >>> class TripForm(Form):
+        ...     fields = {
+        ...         'name': required(unicode),
+        ...         'date': isodate,
+        ...         'stops': {str: {'nights': int}}}
+
+        >>> form = TripForm(params=(
+        ...     ('name', u''), ('date', '1975-09-01'),
+        ...     ('stops.lyon.nights', '3'), ('stops.nice.nights', 'two')))
+
+        >>> from repoze.formapi.state import dump
+        >>> state = dump(form)
+        >>> version, key, entries, flag = state
+        >>> for entry in sorted(entries):
+        ...     print entry
+        (0, (), 1, u'1975-09-01')
+        (1, (), 2, None, ('Required field',))
+        (2, ('lyon',), 0, 3)
+        (2, ('nice',), 2, 'two', ("invalid literal for int() with base 10: 'two'",))
+
+    Pass the state to the form constructor to restore the form; the
+    input of the current step is merged into it.
+
+        >>> form = TripForm(params=(('name', u'Fred'),), state=state)
+        >>> form.data['name'], form.data['date']
+        (u'Fred', datetime.date(1975, 9, 1))
+
+        >>> form.data['stops']['lyon']['nights']
+        3
+
+        >>> sorted(form.errors.flatten())
+        [(('stops', 'nice', 'nights'), "invalid literal for int() with base 10: 'two'")]
+
+    Errors of validators are not stored; they're reported again when
+    the restored form is validated.
+
+        >>> class TitleForm(Form):
+        ...     fields = {'title': unicode, 'year': int}
+        ...
+        ...     @validator('title')
+        ...     def check_title(self):
+        ...         if self.data['title'] == u'Bad':
+        ...             yield "Bad title"
+
+        >>> form = TitleForm(params=(('title', u'Bad'), ('year', 'x')))
+        >>> form.validate()
+        False
+
+        >>> form = TitleForm(params=(), state=dump(form))
+        >>> form.validate()
+        False
+
+        >>> form.errors.flatten()
+        [(('title',), 'Bad title'),
+         (('year',), "invalid literal for int() with base 10: 'x'")]
+
+    """
+
+    schema = type(form).schema
+    layout = get_layout(schema)
+
+    parser = None
+    for layer in form.data:
+        if isinstance(layer, Parser):
+            parser = layer
+
+    entries = []
+    flag = False
+    if parser is not None:
+        if isinstance(parser, LazyParser):
+            parser.materialize()
+        messages = get_messages(form)
+        for path, value in parser.data.iteritems():
+            if path is None:
+                continue
+            entry = layout.entry(path, value, messages.get(path, ()))
+            if entry is not None:
+                entries.append(entry)
+        flag = bool(parser.data.get(None))
+
+    return VERSION, layout.fingerprint, tuple(entries), flag
+
+
+def dumps(form, secret):
+    """Return the parsed state of ``form`` as a string, signed with
+    ``secret`` (see ``loads``).
+
+        >>> class TapeForm(Form):
+        ...     fields = {'title': unicode, 'tracks': [int]}
+
+        >>> from repoze.formapi.state import dumps, loads
+        >>> string = dumps(TapeForm(params=(
+        ...     ('title', u'Moonmadness'), ('tracks', '190'))), 'secret')
+
+        >>> TapeForm(state=loads(string, 'secret')).data['tracks']
+        [190]
+
+    A string that was signed with another secret (or changed) is
+    rejected.
+
+        >>> loads(string, 'other secret')
+        Traceback (most recent call last):
+         ...
+        ValueError: Invalid form state.
+
+    """
+
+    data = marshal.dumps(dump(form))
+    return sign(data, secret) + data
+
+
+def loads(string, secret):
+    """Return form state from a string (see ``dumps``). The signature
+    is verified before the state is unmarshalled, such that a string
+    from an untrusted source is never unmarshalled (which is unsafe).
+
+        >>> from repoze.formapi.state import loads
+        >>> loads('garbage', 'secret')
+        Traceback (most recent call last):
+         ...
+        ValueError: Invalid form state.
+
+    """
+
+    size = sha1().digest_size
+    signature, data = string[:size], string[size:]
+    if not compare(signature, sign(data, secret)):
+        raise ValueError("Invalid form state.")
+
+    try:
+        state = marshal.loads(data)
+    except (EOFError, ValueError, TypeError):
+        raise ValueError("Invalid form state.")
+    return state
+
+
+def sign(data, secret):
+    return hmac.new(secret, data, sha1).digest()
+
+
+def compare(a, b):
+    """Compare strings in constant time."""
+
+    compare_digest = getattr(hmac, 'compare_digest', None)
+    if compare_digest is not None:
+        return compare_digest(a, b)
+    if len(a) != len(b):
+        return False
+    result = 0
+    for x, y in zip(a, b):
+        result |= ord(x) ^ ord(y)
+    return result == 0
+
+
+def restore(state, params, fields, observer=None, lazy=False,
+            repeated=None):
+    """Return ``(data, errors)`` for the form ``state`` with the input
+    ``params`` merged in; the input replaces the stored values of the
+    fields it provides.
+
+        >>> from repoze.formapi.state import restore
+        >>> restore((0, None, (), False), (), {'title': unicode})
+        Traceback (most recent call last):
+         ...
+        ValueError: Form state does not match fields definition.
+
+    """
+
+    schema = get_schema(fields)
+    layout = get_layout(schema)
+
+    try:
+        version, key, entries, flag = state
+    except (TypeError, ValueError):
+        raise ValueError("Invalid form state.")
+
+    if version != VERSION or key != layout.fingerprint:
+        raise ValueError("Form state does not match fields definition.")
+
+    # the input is deferred such that the paths it provides are known
+    # before the stored values are added
+    data, errors = parse(
+        params, schema.fields, observer, lazy=True, repeated=repeated)
+
+    provided = set()
+    for items in data.pending.itervalues():
+        for path, value in items:
+            provided.add(path)
+
+    layout.restore(entries, data, errors, provided)
+    if flag:
+        data.data[None] = True
+
+    if not lazy:
+        data.materialize()
+
+    return data, errors
+
+
+def get_layout(schema):
+    """Return the layout of the compiled ``schema``; it's kept with
+    the schema (see ``cache``)."""
+
+    layout = schema.__dict__.get('layout')
+    if layout is None:
+        layout = schema.layout = Layout(schema)
+    return layout
+
+
+class Layout(object):
+    """Index of the end-points of a compiled schema.
+
+        >>> from repoze.formapi.schema import Schema
+        >>> from repoze.formapi.state import Layout
+        >>> layout = Layout(Schema({
+        ...     'title': unicode, 'tracks': {str: {'length': int}}}))
+
+        >>> layout.fields
+        [<Field title unicode>, <Field tracks.*.length int>]
+
+        >>> layout.locate(('tracks', 'a1', 'length'))
+        (1, ('a1',))
+
+        >>> layout.path(1, ('a1',))
+        ('tracks', 'a1', 'length')
+
+    """
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.fingerprint = fingerprint(schema.fields)
+        self.fields = list(iter_fields(schema.root))
+        self.indexes = dict([
+            (field, index) for (index, field) in enumerate(self.fields)])
+
+        # the positions of the dynamic keys in the path of each field
+        self.positions = [
+            tuple([i for (i, key) in enumerate(field.path)
+                   if not isinstance(key, basestring)])
+            for field in self.fields]
+
+    def locate(self, path):
+        """Return ``(index, keys)`` for ``path``."""
+
+        index = self.indexes.get(self.schema.traverse(path))
+        if index is None:
+            raise KeyError(path)
+        return index, tuple([path[i] for i in self.positions[index]])
+
+    def path(self, index, keys):
+        """Return the path of the field ``index`` for ``keys``."""
+
+        path = list(self.fields[index].path)
+        for i, key in zip(self.positions[index], keys):
+            path[i] = key
+        return tuple(path)
+
+    def entry(self, path, value, messages=()):
+        """Return the state entry for a parsed value and its
+        conversion error ``messages``, or ``None`` if the value can
+        not be stored (e.g. a file upload)."""
+
+        try:
+            index, keys = self.locate(path)
+        except (KeyError, TypeError):
+            return None
+
+        if is_plain(value):
+            if messages:
+                return index, keys, INVALID, value, messages
+            return index, keys, VALUE, value
+
+        field = self.fields[index]
+        try:
+            if field.sequence is None:
+                value = serialize(field.type, value)
+            else:
+                # items that did not convert are kept as-is; the
+                # sequence is converted (and reported) again
+                value = tuple([
+                    type(item) in plain_types and item or
+                    serialize(field.type, item) for item in value])
+                messages = ()
+        except (TypeError, ValueError):
+            return None
+
+        # a field which was submitted more than once may have errors
+        # for values other than the converted one
+        if messages:
+            return index, keys, SERIALIZED, value, messages
+        return index, keys, SERIALIZED, value
+
+    def restore(self, entries, data, errors, provided=()):
+        """Restore state ``entries`` into the lazy parser ``data``,
+        skipping the paths in ``provided``."""
+
+        values = data.data
+        pending = data.pending
+        count = len(self.fields)
+
+        for entry in entries:
+            index = entry[0]
+            if index >= count:
+                raise ValueError("Invalid form state.")
+            path = self.path(index, entry[1])
+            if path in provided:
+                continue
+
+            status = entry[2]
+            value = entry[3]
+            if status == SERIALIZED:
+                if self.fields[index].sequence is not None:
+                    value = list(value)
+                pending.setdefault(path[0], []).append((path, value))
+            else:
+                if type(value) is list:
+                    value = list(value)
+                values[path] = value
+                if value is not None:
+                    values[None] = True
+
+            if len(entry) > 4:
+                e = errors
+                for p in path:
+                    e = e[p]
+                for message in entry[4]:
+                    e += message
+
+
+def iter_fields(node):
+    """Yield the end-points of a compiled schema in a stable order."""
+
+    children = [child for (key, child) in node.static]
+    if node.dynamic is not None:
+        children.append(node.children[node.dynamic])
+
+    for child in children:
+        if hasattr(child, 'static'):
+            for field in iter_fields(child):
+                yield field
+        else:
+            yield child
+
+
+def get_messages(form):
+    """Return the conversion error messages of ``form`` by path; the
+    errors of validators are not part of the state (the restored form
+    is validated again)."""
+
+    errors = form._errors
+    if errors is None:
+        return {}
+
+    validation = {}
+    for entry in form.__dict__.get('_validation_errors') or ():
+        validation[entry] = validation.get(entry, 0) + 1
+
+    messages = {}
+    for path, message in errors.flatten():
+        count = validation.get((path, message))
+        if count:
+            validation[(path, message)] = count - 1
+            continue
+        if not isinstance(message, basestring):
+            message = unicode(message)
+        messages[path] = messages.get(path, ()) + (message,)
+    return messages
+
+
+def is_plain(value):
+    kind = type(value)
+    if kind in plain_types:
+        return True
+    if kind is list or kind is tuple:
+        for item in value:
+            if type(item) not in plain_types:
+                return False
+        return True
+    return False
+
+
+def serialize(type, value):
+    """Return text for a converted value; field types may define a
+    ``serialize`` method (see ``encode``)."""
+
+    if value is None:
+        return None
+    if isinstance(value, FileUpload):
+        raise TypeError("File uploads can not be serialized.")
+    method = getattr(type, 'serialize', None)
+    if method is not None:
+        return method(value)
+    return unicode(value)
@@ -0,0 +1,118 @@
+import sys
+import random
+import threading
+
+from repoze.formapi.encoder import encode
+
+
+def outcome(form):
+    """Return comparable representation of a processed form: the
+    encoded data, the error messages, the submitted action and the
+    status."""
+
+    action = form.action
+    if action is not None:
+        action = action.name
+
+    return (
+        sorted(encode(form.data, type(form).schema)),
+        form.errors.flatten(),
+        action,
+        repr(form.status))
+
+
+def process(form_class, kwargs):
+    """Construct, validate and call a form; return the outcome."""
+
+    form = form_class(**kwargs)
+    form.validate()
+    form()
+    return outcome(form)
+
+
+def stress(form_class, inputs, threads=8, iterations=20, process=process):
+    """Drive ``threads`` threads through ``form_class``.
+
+    Each item in ``inputs`` is a dictionary of keyword arguments for
+    the form constructor. The outcome of each input is computed up
+    front; then each thread processes all inputs (in random order)
+    ``iterations`` times and compares the outcomes. Returns a list of
+    ``(input, expected, actual)`` tuples for mismatches; exceptions
+    raised in a thread are reported as the actual outcome.
+
+        >>> from repoze.formapi.stress import stress
+
+        >>> class TapeForm(Form):
+        ...     fields = {
+        ...         'title': required(unicode),
+        ...         'tracks': {str: {'length': int}}}
+        ...
+        ...     @validator('title')
+        ...     def check_title(self):
+        ...         if self.data['title'] == u'Untitled':
+        ...             yield "Invalid title"
+        ...
+        ...     @action("save")
+        ...     def save(self, data):
+        ...         return data['title']
+
+        >>> inputs = [
+        ...     dict(params=(
+        ...         ('tape.save', ''),
+        ...         ('title', u'Title %d' % i),
+        ...         ('tracks.a%d.length' % i, str(i)),
+        ...         ('tracks.b%d.length' % i, 'long')),
+        ...         prefix='tape')
+        ...     for i in range(10)] + [
+        ...     dict(params=(('title', u'Untitled'),)),
+        ...     dict(params=(('title', u''),))]
+
+        >>> stress(TapeForm, inputs, threads=4, iterations=5)
+        []
+
+    """
+
+    expected = [process(form_class, kwargs) for kwargs in inputs]
+    mismatches = []
+    start = threading.Event()
+
+    def run():
+        order = range(len(inputs))
+        start.wait()
+        for i in xrange(iterations):
+            random.shuffle(order)
+            for index in order:
+                try:
+                    actual = process(form_class, inputs[index])
+                except Exception, exc:
+                    actual = exc
+                if actual != expected[index]:
+                    mismatches.append(
+                        (inputs[index], expected[index], actual))
+
+    workers = [threading.Thread(target=run) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+
+    # switch threads as often as possible to provoke races
+    restore = switch_often()
+    try:
+        start.set()
+        for worker in workers:
+            worker.join()
+    finally:
+        restore()
+
+    return mismatches
+
+
+def switch_often():
+    setswitchinterval = getattr(sys, 'setswitchinterval', None)
+    if setswitchinterval is not None:
+        interval = sys.getswitchinterval()
+        setswitchinterval(1e-6)
+        return lambda: setswitchinterval(interval)
+
+    interval = sys.getcheckinterval()
+    sys.setcheckinterval(1)
+    return lambda: sys.setcheckinterval(interval)
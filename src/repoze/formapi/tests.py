@@ -46,6 +46,20 @@ def test_suite():
             optionflags=OPTIONFLAGS,
             globs=globs,
             package="repoze.formapi"),
+        doctest.DocFileSuite(
+            'codegen.txt',
+            optionflags=OPTIONFLAGS,
+            globs=globs,
+            package="repoze.formapi"),
+        doctest.DocFileSuite(
+            'complexity.txt',
+            optionflags=OPTIONFLAGS,
+            globs=globs,
+            package="repoze.formapi"),
+        doctest.DocTestSuite(
+            'repoze.formapi.feed',
+            optionflags=OPTIONFLAGS,
+            globs=globs),
         doctest.DocTestSuite(
             'repoze.formapi.form',
             optionflags=OPTIONFLAGS,
@@ -57,7 +71,75 @@ def test_suite():
         doctest.DocTestSuite(
             'repoze.formapi.parser',
             optionflags=OPTIONFLAGS,
-            globs=globs)
+            globs=globs),
+        doctest.DocTestSuite(
+            'repoze.formapi.pool',
+            optionflags=OPTIONFLAGS,
+            globs=globs),
+        doctest.DocTestSuite(
+            'repoze.formapi.record',
+            optionflags=OPTIONFLAGS,
+            globs=globs),
+        doctest.DocTestSuite(
+            'repoze.formapi.schema',
+            optionflags=OPTIONFLAGS,
+            globs=globs),
+        doctest.DocTestSuite(
+            'repoze.formapi.instrument',
+            optionflags=OPTIONFLAGS,
+            globs=globs),
+        doctest.DocTestSuite(
+            'repoze.formapi.multipart',
+            optionflags=OPTIONFLAGS,
+            globs=globs),
+        doctest.DocTestSuite(
+            'repoze.formapi.bulk',
+            optionflags=OPTIONFLAGS,
+            globs=globs),
+        doctest.DocTestSuite(
+            'repoze.formapi.cache',
+            optionflags=OPTIONFLAGS,
+            globs=globs),
+        doctest.DocTestSuite(
+            'repoze.formapi.capture',
+            optionflags=OPTIONFLAGS,
+            globs=globs),
+        doctest.DocTestSuite(
+            'repoze.formapi.codegen',
+            optionflags=OPTIONFLAGS,
+            globs=globs),
+        doctest.DocTestSuite(
+            'repoze.formapi.converters',
+            optionflags=OPTIONFLAGS,
+            globs=globs),
+        doctest.DocTestSuite(
+            'repoze.formapi.dedupe',
+            optionflags=OPTIONFLAGS,
+            globs=globs),
+        doctest.DocTestSuite(
+            'repoze.formapi.encoder',
+            optionflags=OPTIONFLAGS,
+            globs=globs),
+        doctest.DocTestSuite(
+            'repoze.formapi.service',
+            optionflags=OPTIONFLAGS,
+            globs=globs),
+        doctest.DocTestSuite(
+            'repoze.formapi.state',
+            optionflags=OPTIONFLAGS,
+            globs=globs),
+        doctest.DocTestSuite(
+            'repoze.formapi.stress',
+            optionflags=OPTIONFLAGS,
+            globs=globs),
+        doctest.DocTestSuite(
+            'repoze.formapi.warmup',
+            optionflags=OPTIONFLAGS,
+            globs=globs),
+        doctest.DocTestSuite(
+            'repoze.formapi.wsgi',
+            optionflags=OPTIONFLAGS,
+            globs=globs),
         ])
 
 if __name__ == '__main__':
@@ -0,0 +1,322 @@
+import cgi
+import re
+import urllib
+
+from repoze.formapi.cache import get_schema
+from repoze.formapi.multipart import get_boundary
+from repoze.formapi.multipart import iter_multipart
+from repoze.formapi.multipart import LimitExceeded
+from repoze.formapi.multipart import MAX_FIELD_SIZE
+
+BUFSIZE = 64 * 1024
+
+re_separator = re.compile(r'[&;]')
+
+
+def parse_environ(environ, fields, prefix=None, charset='utf-8',
+                  max_size=None, max_field_size=MAX_FIELD_SIZE):
+    """Return sequence of ``(name, value)`` pairs from a WSGI
+    environment.
+
+    Parameters are read from the query string and, for form
+    submissions, from the URL-encoded or multipart request body. Names
+    that do not conform to the ``fields`` definition (or the form
+    prefix, if one is given) are discarded before their values are
+    decoded.
+
+    The ``max_size`` argument limits the size of the request body,
+    while ``max_field_size`` limits the size of each part of a
+    multipart request body (by default, 1 MB; file uploads are limited
+    by their field type, see ``upload``). A ``LimitExceeded`` error is
+    raised as soon as a limit is exceeded; a malformed multipart body
+    raises a ``MultipartError``.
+
+        >>> fields = {
+        ...     'title': unicode,
+        ...     'year': int,
+        ...     'tracks': {str: unicode},
+        ...     }
+
+        >>> from StringIO import StringIO
+        >>> body = 'title=Four+Wheel+Drive&junk=%s&tracks.1=Hey+You' % (
+        ...     'x' * 100)
+
+        >>> environ = {
+        ...     'REQUEST_METHOD': 'POST',
+        ...     'QUERY_STRING': 'year=1975&tape_form.save=&session=abc',
+        ...     'CONTENT_TYPE': 'application/x-www-form-urlencoded',
+        ...     'CONTENT_LENGTH': str(len(body)),
+        ...     'wsgi.input': StringIO(body),
+        ...     }
+
+        >>> from repoze.formapi.wsgi import parse_environ
+        >>> params = parse_environ(environ, fields, prefix='tape_form')
+
+    Query string parameters come first. The ``junk`` and ``session``
+    parameters are not part of the form and have been discarded.
+
+        >>> for name, value in params:
+        ...     print repr(name), repr(value)
+        'year' u'1975'
+        'tape_form.save' u''
+        'title' u'Four Wheel Drive'
+        'tracks.1' u'Hey You'
+
+    Note that the request body has been consumed.
+
+        >>> environ['wsgi.input'].read()
+        ''
+
+    The body is read in chunks; parameters that span chunks are
+    joined, while discarded parameters are never buffered.
+
+        >>> environ['wsgi.input'] = StringIO(body)
+        >>> from repoze.formapi.schema import Schema
+        >>> from repoze.formapi.wsgi import iter_urlencoded
+        >>> tuple(iter_urlencoded(
+        ...     environ['wsgi.input'].read, len(body),
+        ...     Schema(fields).__contains__, bufsize=7))
+        (('title', 'Four Wheel Drive'), ('tracks.1', 'Hey You'))
+
+    Request bodies of other content types are ignored.
+
+        >>> environ['wsgi.input'] = StringIO(body)
+        >>> environ['CONTENT_TYPE'] = 'text/plain'
+        >>> len(parse_environ(environ, fields))
+        1
+
+    Multipart request bodies are streamed (see ``iter_multipart``).
+
+        >>> body = '\\r\\n'.join((
+        ...     '--xyz',
+        ...     'Content-Disposition: form-data; name="title"',
+        ...     '',
+        ...     'Four Wheel Drive',
+        ...     '--xyz--',
+        ...     ''))
+
+        >>> environ['CONTENT_TYPE'] = 'multipart/form-data; boundary=xyz'
+        >>> environ['CONTENT_LENGTH'] = str(len(body))
+        >>> environ['wsgi.input'] = StringIO(body)
+        >>> parse_environ(environ, fields)
+        [('year', u'1975'), ('title', u'Four Wheel Drive')]
+
+    The size of the request body is checked before it's read.
+
+        >>> parse_environ(environ, fields, max_size=16)
+        Traceback (most recent call last):
+         ...
+        LimitExceeded: Request body exceeds size limit (16 bytes).
+
+    Names are kept as byte strings, like the keys of the fields
+    definition; values are decoded, with bytes that are invalid in the
+    charset replaced.
+
+        >>> environ = {'QUERY_STRING': 'title=%FF&tracks.a1=Hey+You'}
+        >>> parse_environ(environ, fields)
+        [('title', u'\ufffd'), ('tracks.a1', u'Hey You')]
+
+        >>> class TapeForm(Form):
+        ...     fields = fields
+
+        >>> form = TapeForm(environ=environ)
+        >>> form.data['title'], form.data['tracks']['a1']
+        (u'\ufffd', u'Hey You')
+
+    """
+
+    schema = get_schema(fields)
+
+    accept = acceptor(schema, prefix)
+    params = []
+
+    query_string = environ.get('QUERY_STRING')
+    if query_string:
+        for segment in re_separator.split(query_string):
+            pair = split_segment(segment, accept)
+            if pair is not None:
+                params.append(pair)
+
+    if environ.get('REQUEST_METHOD', 'GET') in ('POST', 'PUT'):
+        content_type, options = cgi.parse_header(
+            environ.get('CONTENT_TYPE', ''))
+        content_type = content_type.lower()
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+
+        if content_type in ('', 'application/x-www-form-urlencoded'):
+            check_size(length, max_size)
+            read = environ['wsgi.input'].read
+            params.extend(iter_urlencoded(read, length, accept))
+
+        elif content_type == 'multipart/form-data':
+            check_size(length, max_size)
+            read = environ['wsgi.input'].read
+            params.extend(iter_multipart(
+                read, get_boundary(options), length, accept, schema,
+                charset=charset, max_field_size=max_field_size))
+
+    return [(name, decode(value, charset)) for (name, value) in params]
+
+
+def check_size(length, max_size):
+    if max_size is not None and length > max_size:
+        raise LimitExceeded(
+            "Request body exceeds size limit (%d bytes)." % max_size)
+
+
+def decode(value, charset):
+    """Return ``value`` decoded; bytes that are invalid in the
+    charset are replaced (rather than failing the request)."""
+
+    if isinstance(value, str):
+        return value.decode(charset, 'replace')
+    return value
+
+
+def acceptor(schema, prefix=None):
+    """Return predicate for parameter names that should be parsed
+    for a form with the provided ``schema`` and ``prefix``."""
+
+    if prefix is None:
+        return schema.__contains__
+
+    length = len(prefix)
+
+    def accept(name):
+        if name.startswith(prefix):
+            if len(name) == length or name[length] in '._-':
+                return True
+        return name in schema
+
+    return accept
+
+
+def split_segment(segment, accept):
+    name, sep, value = segment.partition('=')
+    if not name:
+        return None
+    name = unquote(name)
+    if not accept(name):
+        return None
+    return name, unquote(value)
+
+
+def iter_urlencoded(read, length, accept, bufsize=BUFSIZE):
+    """Yield ``(name, value)`` pairs from a URL-encoded stream of
+    ``length`` bytes. Values are only buffered and unquoted for names
+    that ``accept``."""
+
+    decoder = Decoder(accept)
+
+    while length > 0:
+        chunk = read(min(bufsize, length))
+        if not chunk:
+            break
+        length -= len(chunk)
+
+        for pair in decoder.feed(chunk):
+            yield pair
+
+    for pair in decoder.close():
+        yield pair
+
+
+class Decoder(object):
+    """Incremental decoder for URL-encoded input; chunks are passed to
+    ``feed`` as they arrive, which returns the completed pairs.
+
+        >>> from repoze.formapi.wsgi import Decoder
+        >>> decoder = Decoder(lambda name: name != 'junk')
+        >>> decoder.feed('title=Four+Wh')
+        []
+        >>> decoder.feed('eel+Drive&junk=xxx')
+        [('title', 'Four Wheel Drive')]
+        >>> decoder.feed('xxx&year=19')
+        []
+        >>> decoder.close()
+        [('year', '19')]
+
+    Discarded values are never buffered.
+
+        >>> decoder.feed('junk=xxx'), decoder.feed('xxx'), decoder.pending
+        ([], [], [])
+        >>> decoder.close()
+        []
+
+    """
+
+    def __init__(self, accept):
+        self.accept = accept
+        self.pending = []
+        self.name = None
+        self.discard = False
+
+    def feed(self, chunk):
+        accept = self.accept
+        pending = self.pending
+        name = self.name
+        discard = self.discard
+        pairs = []
+
+        parts = re_separator.split(chunk)
+        last = len(parts) - 1
+
+        for i, part in enumerate(parts):
+            if name is None:
+                if '=' in part:
+                    head, part = part.split('=', 1)
+                    pending.append(head)
+                    name = unquote(''.join(pending))
+                    pending = []
+                    discard = not name or not accept(name)
+                    if not discard:
+                        pending.append(part)
+                else:
+                    pending.append(part)
+            elif not discard:
+                pending.append(part)
+
+            if i == last:
+                break
+
+            # end of segment
+            if name is None:
+                name = unquote(''.join(pending))
+                if name and accept(name):
+                    pairs.append((name, ''))
+            elif not discard:
+                pairs.append((name, unquote(''.join(pending))))
+
+            pending = []
+            name = None
+            discard = False
+
+        self.pending = pending
+        self.name = name
+        self.discard = discard
+        return pairs
+
+    def close(self):
+        """Return the pairs of the remaining input."""
+
+        pending = self.pending
+        name = self.name
+        discard = self.discard
+        self.pending = []
+        self.name = None
+        self.discard = False
+
+        if name is None:
+            if pending:
+                name = unquote(''.join(pending))
+                if name and self.accept(name):
+                    return [(name, '')]
+        elif not discard:
+            return [(name, unquote(''.join(pending)))]
+        return []
+
+
+def unquote(string):
+    if '%' in string or '+' in string:
+        return urllib.unquote_plus(string)
+    return string